@@ -0,0 +1,131 @@
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+API_URL = "http://localhost:8000"
+
+# Seconds a cached read is served before it is fetched again
+CACHE_TTL = 60
+
+
+class APIError(RuntimeError):
+    """Non-200 response from the TabSense API"""
+
+    def __init__(self, response: requests.Response):
+        super().__init__(f"{response.status_code} - {response.text}")
+        self.status_code = response.status_code
+
+
+@st.cache_resource
+def session() -> requests.Session:
+    """Keep-alive session shared by every page and rerun"""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def get(path: str, **kwargs) -> requests.Response:
+    return session().get(f"{API_URL}{path}", **kwargs)
+
+
+def post(path: str, **kwargs) -> requests.Response:
+    return session().post(f"{API_URL}{path}", **kwargs)
+
+
+def _json(response: requests.Response):
+    if response.status_code != 200:
+        raise APIError(response)
+    return response.json()
+
+
+# Cached reads
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def entries(client: str):
+    """All schedule entries of a client"""
+    return _json(get("/entry", params={"client": client}))
+
+
+def rooms(client: str):
+    """Sorted room names that appear in a client's schedule"""
+    return sorted(set(entry.get("room", "") for entry in entries(client) if "room" in entry))
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cameras(client: str, room: str = None, sector: int = None, id: str = None):
+    """Camera records matching the filters; a dict when a single camera matches"""
+    params = {"client": client}
+    if room:
+        params["room"] = room
+    if sector:
+        params["sector"] = sector
+    if id:
+        params["id"] = id
+    return _json(get("/cam", params=params))
+
+
+def sectors(client: str, room: str):
+    """Sorted sector numbers that have a camera in the room"""
+    cams = cameras(client, room)
+    if isinstance(cams, list):
+        return sorted(set(cam.get("sector", 1) for cam in cams))
+    elif isinstance(cams, dict):
+        return [cams.get("sector", 1)]
+    return []
+
+
+# Writes, which drop the cached reads they affect
+
+def _invalidating(response: requests.Response, *caches):
+    if response.status_code == 200:
+        for cache in caches:
+            cache.clear()
+    return response
+
+
+def add_entry(payload: dict) -> requests.Response:
+    return _invalidating(post("/entry/add", json=payload), entries)
+
+
+def update_entry(client: str, id: str, payload: dict) -> requests.Response:
+    return _invalidating(post("/entry/update", params={"client": client, "id": id}, json=payload), entries)
+
+
+def delete_entry(client: str, id: str) -> requests.Response:
+    return _invalidating(post("/entry/deleteone", params={"id": id, "client": client, "room": ""}), entries)
+
+
+def delete_entries(client: str, room: str = None, ids: list = None) -> requests.Response:
+    params = {"client": client}
+    if room is not None:
+        params["room"] = room
+    json = {"id": ids} if ids is not None else None
+    return _invalidating(post("/entry/delete", params=params, json=json), entries)
+
+
+def add_camera(payload: dict) -> requests.Response:
+    return _invalidating(post("/cam", json=payload), cameras)
+
+
+def update_camera(client: str, id: str, payload: dict) -> requests.Response:
+    return _invalidating(post("/cam/update", params={"client": client, "id": id}, json=payload), cameras)
+
+
+def delete_camera(client: str, room: str = None, sector: int = None, id: str = None) -> requests.Response:
+    params = {"client": client}
+    if room is not None:
+        params["room"] = room
+    if sector is not None:
+        params["sector"] = sector
+    if id is not None:
+        params["id"] = id
+    return _invalidating(post("/cam/delete", params=params), cameras)
+
+
+# Uncached calls
+
+def detect(payload: dict) -> requests.Response:
+    return get("/detect", params=payload)
+
@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import stain_kernel
+from camera_pool import fit
+from control_cache import ControlFrame
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Where each sector's background is kept between restarts
+BASELINE_DIR = "imagedata/baseline"
+# Subdirectory of BASELINE_DIR holding the references handed to detection workers
+SNAPSHOT_DIR = "snapshots"
+# Weight of a new capture in the running average; 0.05 follows a lighting
+# change within roughly 20 captures
+LEARNING_RATE = float(os.getenv("TABSENSE_BASELINE_RATE", "0.05"))
+# Grey-level difference past which a pixel is taken for a stain or an object
+# and left out of the update, so it keeps showing up until it is gone
+FOREGROUND_THRESHOLD = stain_kernel.DIFF_THRESHOLD
+# Share of differing pixels past which the whole scene is taken to have
+# changed (lights switched, blinds opened, furniture moved)
+RELEARN_FRACTION = 0.5
+# Consecutive captures that must agree on a changed scene before it is
+# learned, so a busy room is not mistaken for a new background
+RELEARN_CAPTURES = 3
+# Share of pixels that may differ between captures agreeing on a new scene
+RELEARN_AGREEMENT = 0.05
+# Pixel stride when fitting a lighting change; a sample is plenty for two numbers
+RELIGHT_STRIDE = 4
+
+
+def _changed(a, b):
+    """Share of pixels that differ between two greyscale planes"""
+    return 1 - cv2.countNonZero(np.uint8(cv2.absdiff(a, b) <= FOREGROUND_THRESHOLD)) / a.size
+
+
+def _relight(background, gray, usable=None):
+    """`background` under the lighting of `gray`, or None if no lighting change fits.
+
+    Fits a gain and offset between the two, refitted on the pixels the
+    first fit explains so stains and people do not skew it. `usable`
+    limits the fit to where it is non-zero.
+    """
+    old = background[::RELIGHT_STRIDE, ::RELIGHT_STRIDE].ravel()
+    new = gray[::RELIGHT_STRIDE, ::RELIGHT_STRIDE].ravel()
+    keep = np.ones(old.shape, bool) if usable is None else usable[::RELIGHT_STRIDE, ::RELIGHT_STRIDE].ravel() > 0
+    gain, offset = 1.0, 0.0
+    for _ in range(2):
+        if keep.sum() < 100 or np.ptp(old[keep]) == 0:
+            return None
+        gain, offset = np.polyfit(old[keep], new[keep], 1)
+        keep &= np.abs(old * gain + offset - new) <= FOREGROUND_THRESHOLD
+    return np.clip(background * np.float32(gain) + np.float32(offset), 0, 255).astype(np.float32)
+
+
+def _table_mask(region, shape):
+    """Full-frame mask that is non-zero on the table, or None without a region"""
+    if region is None:
+        return None
+    x, y, w, h, mask = region
+    table = np.zeros(shape, np.uint8)
+    table[y:y + h, x:x + w] = mask
+    return table
+
+
+class BaselineStore:
+    """Rolling background of every sector, used as its detection reference.
+
+    Each sector keeps an exponential moving average of its greyscale
+    captures at the working resolution, stored as float16. An update costs
+    one pass over the pixels and skips the ones that differ from the
+    background, so gradual lighting drift is followed while stains are not
+    absorbed. A sudden change of the whole scene is relit if it is down to
+    lighting, and otherwise only learned once RELEARN_CAPTURES captures in
+    a row agree on it; even then the table keeps its relit background, so
+    a stain left behind still shows. Backgrounds are written to
+    BASELINE_DIR after every update and picked up again on restart.
+    """
+
+    def __init__(self, root=BASELINE_DIR, rate=LEARNING_RATE):
+        self.root = root
+        self.rate = rate
+        self._backgrounds = {}
+        self._references = {}
+        # key -> (last capture of a changed scene, captures agreeing on it)
+        self._pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, SNAPSHOT_DIR), exist_ok=True)
+
+    def path(self, key):
+        """The .npy file holding the background of a (client, room, sector) key"""
+        name = "-".join(re.sub(r"[^\w.]+", "_", str(part)) for part in key)
+        return os.path.join(self.root, f"{name}.npy")
+
+    def snapshot_path(self, capture_id, sector):
+        """The .npy file a capture's reference is frozen in for detection workers"""
+        return os.path.join(self.root, SNAPSHOT_DIR, f"{capture_id}-{sector}.npy")
+
+    def snapshot(self, reference, capture_id, sector):
+        """Freeze the reference a capture was compared against, as later updates move on; returns its path"""
+        path = self.snapshot_path(capture_id, sector)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, reference.gray)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    def prune_snapshots(self, max_age):
+        """Remove snapshots older than `max_age` seconds, left by bundles that were never finished"""
+        cutoff = time.time() - max_age
+        folder = os.path.join(self.root, SNAPSHOT_DIR)
+        removed = 0
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"Removed {removed} baseline snapshots no detection worker finished with")
+        return removed
+
+    def _background(self, key):
+        with self._lock:
+            background = self._backgrounds.get(key)
+        if background is None and os.path.exists(self.path(key)):
+            try:
+                background = np.load(self.path(key))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Discarding unreadable baseline {self.path(key)}: {str(e)}")
+        return background
+
+    def reference(self, key):
+        """The current background of a sector as a ControlFrame, or None before its first capture"""
+        with self._lock:
+            reference = self._references.get(key)
+        if reference is not None:
+            return reference
+        background = self._background(key)
+        if background is None:
+            return None
+        reference = ControlFrame(np.round(background.astype(np.float32)).astype(np.uint8))
+        with self._lock:
+            return self._references.setdefault(key, reference)
+
+    def _scene_changed(self, key, background, gray, region):
+        """The background to learn from after the whole scene changed, or None to wait"""
+        relit = _relight(background, gray)
+        if relit is not None and _changed(relit, gray) <= RELEARN_FRACTION:
+            with self._lock:
+                self._pending.pop(key, None)
+            logger.info(f"Lighting of {key} changed; relighting its baseline")
+            return relit
+
+        with self._lock:
+            last, count = self._pending.get(key, (None, 0))
+            count = count + 1 if last is not None and _changed(last, gray) <= RELEARN_AGREEMENT else 1
+            if count < RELEARN_CAPTURES:
+                self._pending[key] = (gray, count)
+                logger.info(f"Scene of {key} changed as a whole; relearning after "
+                            f"{RELEARN_CAPTURES - count} more matching captures")
+                return None
+            self._pending.pop(key, None)
+
+        learned = gray.copy()
+        table = _table_mask(region, gray.shape)
+        if table is not None:
+            relit = _relight(background, gray, usable=255 - table)
+            learned[table > 0] = (background if relit is None else relit)[table > 0]
+        logger.info(f"Scene of {key} changed as a whole; relearning its baseline")
+        return learned
+
+    def update(self, key, frame, region=None):
+        """Learn the background of a sector from an aligned capture; returns the new reference.
+
+        `region` is the sector's table from sector_roi.region, or None for
+        the whole frame.
+        """
+        gray = np.float32(cv2.cvtColor(fit(frame), cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else fit(frame))
+        background = self._background(key)
+        learned = None if background is None or background.shape != gray.shape else background.astype(np.float32)
+        if learned is not None:
+            if _changed(gray, learned) > RELEARN_FRACTION:
+                learned = self._scene_changed(key, learned, gray, region)
+                if learned is None:
+                    return self.reference(key)
+            else:
+                with self._lock:
+                    self._pending.pop(key, None)
+            still = np.uint8(cv2.absdiff(gray, learned) <= FOREGROUND_THRESHOLD)
+            cv2.accumulateWeighted(gray, learned, self.rate, mask=still)
+        if learned is None:
+            learned = gray
+        background = learned.astype(np.float16)
+
+        reference = ControlFrame(np.round(learned).astype(np.uint8))
+        with self._lock:
+            self._backgrounds[key] = background
+            self._references[key] = reference
+
+        path = self.path(key)
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, background)
+        os.replace(f"{path}.tmp", path)
+        return reference
@@ -0,0 +1,73 @@
+import pandas as pd
+
+import sector_roi
+
+REQUIRED_COLUMNS = ["room", "sector", "link"]
+# Optional capture profile columns: a lower-resolution stream, a "WIDTHxHEIGHT"
+# size and the table region as a JSON list of [x, y] fractions
+OPTIONAL_COLUMNS = ["substream", "resolution", "roi"]
+# Links are RTSP/HTTP URLs or a local device number
+LINK_PATTERN = r"^(?:(?:rtsps?|https?)://\S+|\d+)$"
+RESOLUTION_PATTERN = r"^\d{2,5}[xX]\d{2,5}$"
+
+
+def _roi_error(value):
+    try:
+        sector_roi.parse_roi(value)
+        return ""
+    except (TypeError, ValueError) as e:
+        return str(e)
+
+
+def validate_cameras(df: pd.DataFrame, existing=()):
+    """Validate a camera import in one pass over whole columns.
+
+    `existing` is an iterable of (room, sector) pairs already registered.
+    Returns (records, errors): the valid rows as API payload dicts, and a
+    list of {"row", "error"} for the rejected ones, with 1-based row numbers.
+    """
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"CSV file must contain these columns: {', '.join(REQUIRED_COLUMNS)}")
+
+    room = df["room"].astype("string").str.strip()
+    sector = pd.to_numeric(df["sector"], errors="coerce")
+    link = df["link"].astype("string").str.strip()
+    substream, resolution, roi = (
+        df[col].astype("string").str.strip().fillna("") if col in df.columns else pd.Series("", index=df.index, dtype="string")
+        for col in OPTIONAL_COLUMNS
+    )
+    # Regions are nested lists, so only the rows that give one are parsed
+    roi_error = roi[roi != ""].map(_roi_error).reindex(df.index, fill_value="")
+
+    checks = {
+        "room is empty": room.isna() | (room == ""),
+        "sector must be a whole number of at least 1": sector.isna() | (sector % 1 != 0) | (sector < 1),
+        "link must be an rtsp://, http(s):// URL or a device number": ~link.fillna("").str.match(LINK_PATTERN),
+        "substream must be an rtsp://, http(s):// URL or a device number": (substream != "") & ~substream.str.match(LINK_PATTERN),
+        "resolution must look like 1280x720": (resolution != "") & ~resolution.str.match(RESOLUTION_PATTERN),
+        "roi must be a JSON list of at least 3 [x, y] points between 0 and 1": roi_error != "",
+        "duplicate room and sector in file": df.assign(room=room, sector=sector).duplicated(["room", "sector"], keep=False),
+    }
+    existing = [(str(r), float(s)) for r, s in existing]
+    if existing:
+        keys = pd.MultiIndex.from_arrays([room.fillna(""), sector])
+        checks["camera already exists for room and sector"] = pd.Series(
+            keys.isin(pd.MultiIndex.from_tuples(existing)), index=df.index
+        )
+
+    failed = pd.DataFrame(checks).to_numpy()
+    bad = failed.any(axis=1)
+    reasons = pd.Index(checks)
+    errors = [{"row": int(i) + 1, "error": "; ".join(reasons[failed[i]])} for i in bad.nonzero()[0]]
+
+    valid = pd.DataFrame({"room": room, "sector": sector, "link": link, "substream": substream,
+                          "resolution": resolution.str.lower(), "roi": roi})[~bad]
+    records = [
+        {"id": "", "room": r, "sector": int(s), "link": l, "substream": sub, "resolution": res,
+         "roi": sector_roi.parse_roi(region)}
+        for r, s, l, sub, res, region in zip(valid["room"], valid["sector"], valid["link"], valid["substream"],
+                                             valid["resolution"], valid["roi"])
+    ]
+    return records, errors
+
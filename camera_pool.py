@@ -0,0 +1,290 @@
+import io
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from stain_kernel import WORK_SIZE
+
+logger = logging.getLogger("TabSense-Cameras")
+
+# Seconds a session may sit unused before it is closed
+IDLE_TIMEOUT = 600
+# Reconnect backoff bounds in seconds
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
+# Frames older than this are treated as stale when reading
+MAX_FRAME_AGE = 5
+# Seconds after the last read during which grabbed frames are also decoded
+DECODE_WINDOW = 30
+# Seconds spent picking the best of the incoming frames for a capture
+CAPTURE_BUDGET = 1.0
+# Captures scoring below this are rejected as smeared, partial or badly exposed;
+# off by default, as dim or plain tables can score low while perfectly usable
+MIN_QUALITY = float(os.getenv("TABSENSE_MIN_FRAME_QUALITY", "0"))
+# Laplacian variance at which sharpness scores 0.5
+SHARPNESS_SCALE = 100.0
+# Frames leave the pool at the detector's working resolution, so nothing
+# downstream resizes them again
+CAPTURE_SIZE = WORK_SIZE
+
+
+def parse_resolution(value):
+    """Parse a "WIDTHxHEIGHT" camera resolution into (width, height), or None if unset"""
+    if not value:
+        return None
+    width, height = str(value).lower().split("x")
+    return int(width), int(height)
+
+
+def fit(frame, size=CAPTURE_SIZE):
+    """Bring a frame to `size` with a single area-averaging resize"""
+    if frame.shape[1::-1] == tuple(size):
+        return frame
+    return cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+
+
+def decode_image(data, size=CAPTURE_SIZE):
+    """Decode an encoded snapshot straight to `size`.
+
+    JPEG snapshots are decoded at 1/2, 1/4 or 1/8 scale whenever that still
+    covers `size`, so a 4K snapshot never becomes a full 4K frame.
+    """
+    flags = cv2.IMREAD_COLOR
+    header = Image.open(io.BytesIO(data))
+    if header.format == "JPEG":
+        scale = min(header.size[0] // size[0], header.size[1] // size[1])
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if scale >= factor:
+                flags = reduced
+                break
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if frame is None:
+        raise RuntimeError("Failed to decode camera snapshot")
+    return fit(frame, size)
+
+
+def frame_quality(frame):
+    """Score a frame from 0 to 1 on sharpness and exposure.
+
+    Sharpness is the variance of the Laplacian, which collapses on the
+    smeared or grey partial frames H.264 streams produce after a lost
+    keyframe; exposure penalises dark, blown-out and clipped images.
+    """
+    height, width = frame.shape[:2]
+    small = cv2.resize(frame, (320, max(1, round(height * 320 / width))), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    variance = cv2.Laplacian(gray, cv2.CV_32F).var()
+    sharpness = variance / (variance + SHARPNESS_SCALE)
+    clipped = np.count_nonzero((gray <= 5) | (gray >= 250)) / gray.size
+    exposure = (1 - abs(float(gray.mean()) - 128) / 128) * (1 - clipped)
+    return round(float(sharpness * exposure), 4)
+
+
+def open_capture(link, resolution=None):
+    """Open a cv2.VideoCapture, treating digit-only links as local device numbers.
+
+    A `resolution` is requested from the device; network streams ignore
+    it and should point at a substream of the wanted size instead.
+    """
+    source = int(link) if str(link).isdigit() else link
+    cap = cv2.VideoCapture(source)
+    if resolution and cap.isOpened():
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+    return cap
+
+
+class CameraSession:
+    """A long-lived stream for one camera link.
+
+    A background thread keeps the stream open and continuously drains it
+    with `grab()`, reconnecting with exponential backoff whenever the
+    stream drops. Grabbed frames are only decoded into the "latest frame"
+    buffer while the session is being read, so idle cameras cost little,
+    and are brought to `size` as they are decoded. Sampling outside of
+    that window decodes just the next grabbed frame, as it comes.
+    """
+
+    def __init__(self, link, resolution=None, size=CAPTURE_SIZE):
+        self.link = link
+        self.resolution = resolution
+        self.size = size
+        self.last_used = time.monotonic()
+        self.last_sampled = 0.0
+        self._frame = None
+        self._frame_time = 0.0
+        self._frame_seq = 0
+        self._sampled = None
+        self._sampled_time = 0.0
+        self._sample_wanted = False
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"camera-{link}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        delay = RECONNECT_MIN
+        while not self._stop.is_set():
+            cap = open_capture(self.link, self.resolution)
+            if cap.isOpened():
+                logger.info(f"Opened camera stream {self.link}")
+                while not self._stop.is_set():
+                    if not cap.grab():
+                        break
+                    delay = RECONNECT_MIN
+                    if time.monotonic() - self.last_used > DECODE_WINDOW:
+                        if self._sample_wanted:
+                            ret, frame = cap.retrieve()
+                            if ret:
+                                with self._lock:
+                                    self._sampled, self._sampled_time = frame, time.monotonic()
+                                    self._sample_wanted = False
+                        continue
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        continue
+                    frame = fit(frame, self.size)
+                    with self._lock:
+                        self._frame = frame
+                        self._frame_time = time.monotonic()
+                        self._frame_seq += 1
+                        self._new_frame.notify_all()
+            cap.release()
+
+            if not self._stop.is_set():
+                logger.warning(f"Camera stream {self.link} unavailable, reconnecting in {delay}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    def read(self, timeout=10, max_age=MAX_FRAME_AGE):
+        """Return a copy of the latest frame, waiting up to `timeout` for a fresh one"""
+        self.last_used = time.monotonic()
+        deadline = self.last_used + timeout
+        with self._lock:
+            while self._frame is None or time.monotonic() - self._frame_time > max_age:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._new_frame.wait(remaining)
+            return self._frame.copy()
+
+    def sample(self, max_age=MAX_FRAME_AGE):
+        """Return a copy of a recent frame without keeping the session decoding, or None.
+
+        Asks for the next grabbed frame to be decoded and returns the freshest
+        one seen within `max_age`, so a caller polling every so often costs
+        one decode per poll. Sampled frames keep their stream size.
+        """
+        self.last_sampled = time.monotonic()
+        with self._lock:
+            self._sample_wanted = True
+            frame, frame_time = self._frame, self._frame_time
+            if self._sampled_time > frame_time:
+                frame, frame_time = self._sampled, self._sampled_time
+            if frame is None or self.last_sampled - frame_time > max_age:
+                return None
+            return frame.copy()
+
+    def read_best(self, budget=CAPTURE_BUDGET, timeout=10, max_age=MAX_FRAME_AGE):
+        """Return (frame, quality) for the best frame seen within `budget` seconds.
+
+        Waits up to `timeout` for a first fresh frame, then scores every new
+        frame until the budget runs out. Returns (None, 0.0) without a frame.
+        """
+        frame = self.read(timeout=timeout, max_age=max_age)
+        if frame is None:
+            return None, 0.0
+        best, best_quality = frame, frame_quality(frame)
+        deadline = time.monotonic() + budget
+        with self._lock:
+            seq = self._frame_seq
+        while True:
+            with self._lock:
+                while self._frame_seq == seq and not self._stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return best, best_quality
+                    self._new_frame.wait(remaining)
+                if self._stop.is_set():
+                    return best, best_quality
+                frame, seq = self._frame.copy(), self._frame_seq
+            quality = frame_quality(frame)
+            if quality > best_quality:
+                best, best_quality = frame, quality
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._new_frame.notify_all()
+
+    @property
+    def closed(self):
+        return self._stop.is_set()
+
+
+class CameraPool:
+    """Camera sessions keyed by link, with idle eviction"""
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._evictor = threading.Thread(target=self._evict_loop, name="camera-evictor", daemon=True)
+        self._evictor.start()
+
+    def session(self, link, resolution=None):
+        """Get the open session for a link, starting one if needed.
+
+        A session opened with a different `resolution` is replaced.
+        """
+        link = str(link)
+        with self._lock:
+            session = self._sessions.get(link)
+            if session is not None and resolution and session.resolution != resolution:
+                session.close()
+            if session is None or session.closed:
+                session = CameraSession(link, resolution)
+                self._sessions[link] = session
+            return session
+
+    def read(self, link, timeout=10, max_age=MAX_FRAME_AGE, resolution=None):
+        """Read the latest frame for a camera link, or None if unavailable"""
+        return self.session(link, resolution).read(timeout=timeout, max_age=max_age)
+
+    def sample(self, link, max_age=MAX_FRAME_AGE, resolution=None):
+        """Sample a recent frame for a camera link without keeping it decoding every frame"""
+        return self.session(link, resolution).sample(max_age=max_age)
+
+    def read_best(self, link, budget=CAPTURE_BUDGET, timeout=10, max_age=MAX_FRAME_AGE, resolution=None):
+        """Read the best-scoring frame for a camera link within `budget` seconds, as (frame, quality)"""
+        return self.session(link, resolution).read_best(budget=budget, timeout=timeout, max_age=max_age)
+
+    def evict_idle(self):
+        """Close sessions that have not been read or sampled for `idle_timeout` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [link for link, s in self._sessions.items()
+                    if now - max(s.last_used, s.last_sampled) > self.idle_timeout]
+            for link in idle:
+                self._sessions.pop(link).close()
+        for link in idle:
+            logger.info(f"Closed idle camera session {link}")
+
+    def _evict_loop(self):
+        while not self._stop.wait(min(self.idle_timeout, 60)):
+            self.evict_idle()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
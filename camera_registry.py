@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+from camera_pool import parse_resolution
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Seconds a client's cameras are trusted before they are reloaded
+CAMERA_TTL = 3600
+# Shortest gap between reloads triggered by a lookup miss
+MISS_RELOAD_INTERVAL = 60
+
+
+def camera_collection(client):
+    return f"{client}-cameras"
+
+
+def _stream(camera):
+    return camera.get("substream") or camera.get("link"), camera.get("resolution")
+
+
+class CameraRegistry:
+    """In-process cache of camera records keyed by (client, room, sector).
+
+    All cameras of a client are bulk-loaded with a single query and kept
+    for `ttl` seconds, so resolving a link on a scheduler tick costs no
+    round-trips. `invalidate` drops a client or a single camera early.
+
+    The registry also remembers the transform that last aligned each
+    camera's captures, see registration, and forgets it when the camera's
+    stream changes.
+    """
+
+    def __init__(self, db, ttl=CAMERA_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._cameras = {}
+        self._loaded = {}
+        self._transforms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(client, room, sector):
+        return (client, str(room), int(sector))
+
+    def load(self, client):
+        """Bulk-load every camera of a client, replacing what is cached"""
+        cameras = list(self.db[camera_collection(client)].find({}, {"_id": 0}))
+        with self._lock:
+            previous = {key: self._cameras.pop(key) for key in [key for key in self._cameras if key[0] == client]}
+            for camera in cameras:
+                key = self._key(client, camera["room"], camera["sector"])
+                self._cameras[key] = camera
+                if key in previous and _stream(previous[key]) != _stream(camera):
+                    # A different stream does not share the old one's viewpoint
+                    self._transforms.pop(key, None)
+            self._loaded[client] = time.monotonic()
+        logger.info(f"Loaded {len(cameras)} cameras for client {client}")
+        return cameras
+
+    def get(self, client, room, sector):
+        """Return the camera record for a sector, or None if there is none"""
+        key = self._key(client, room, sector)
+        with self._lock:
+            loaded = self._loaded.get(client)
+            age = None if loaded is None else time.monotonic() - loaded
+            camera = self._cameras.get(key)
+        if age is None or age > self.ttl or (camera is None and age > MISS_RELOAD_INTERVAL):
+            self.load(client)
+            with self._lock:
+                camera = self._cameras.get(key)
+        return camera
+
+    def link(self, client, room, sector):
+        camera = self.get(client, room, sector)
+        return camera["link"] if camera else None
+
+    def source(self, client, room, sector):
+        """Return (link, resolution) to capture a sector from, or (None, None).
+
+        Prefers the camera's lower-resolution `substream` when it has one;
+        `resolution` is its optional "WIDTHxHEIGHT" capture size.
+        """
+        camera = self.get(client, room, sector)
+        if camera is None:
+            return None, None
+        try:
+            resolution = parse_resolution(camera.get("resolution"))
+        except ValueError:
+            logger.warning(f"Ignoring invalid resolution {camera['resolution']!r} for {room}, sector {sector}")
+            resolution = None
+        return camera.get("substream") or camera["link"], resolution
+
+    def transform(self, client, room, sector):
+        """The transform that aligned the sector's last capture, or None"""
+        with self._lock:
+            return self._transforms.get(self._key(client, room, sector))
+
+    def set_transform(self, client, room, sector, transform):
+        """Remember the sector's alignment for its next capture; None starts over"""
+        key = self._key(client, room, sector)
+        with self._lock:
+            if transform is None:
+                self._transforms.pop(key, None)
+            else:
+                self._transforms[key] = transform
+
+    def invalidate(self, client=None, room=None, sector=None):
+        """Forget cached cameras for everything, one client, or one camera's client"""
+        with self._lock:
+            if client is None:
+                self._cameras.clear()
+                self._loaded.clear()
+            else:
+                if room is not None:
+                    self._cameras.pop(self._key(client, room, sector), None)
+                # The next lookup reloads the client with one query
+                self._loaded.pop(client, None)
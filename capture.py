@@ -1,4 +1,3 @@
-import schedule
 import time
 from datetime import datetime, timezone, time, timedelta
 import pymongo
@@ -8,6 +7,11 @@ from typing import List
 import cv2
 import detectapi
 from pydantic import BaseModel
+from camera_pool import CameraPool, MIN_QUALITY
+from camera_registry import CameraRegistry
+from event_scheduler import EventScheduler, daily_at
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 mongocreds = os.getenv("mongocred")
 base = pymongo.MongoClient(f"mongodb://{mongocreds}@localhost:27017")
@@ -16,13 +20,26 @@ db=base["tablesense"]
 client = "acme"
 scheduleraw = db[f"{client}-schedule"].find()
 
+# Camera streams stay open between captures instead of reconnecting each time
+cameras = CameraPool()
+registry = CameraRegistry(db)
+
+# Sleeps until the next capture is due; captures run off the timer thread
+scheduler = EventScheduler(executor=ThreadPoolExecutor(max_workers=8))
+
 def controlcapture(room:str, sector:int, id:str, days:List[str]):
     
     if datetime.now().strftime("%A") in days:
         # try:
-        cap = cv2.VideoCapture(detectapi.getCamLink(client,room,sector)["link"]) #IP Camera
-        ret, frame = cap.read()
-        frame = cv2.resize(frame,(1024, 576))
+        link, resolution = registry.source(client,room,sector) #IP Camera
+        frame, quality = cameras.read_best(link, resolution=resolution) if link else (None, 0.0)
+        if frame is None:
+            registry.invalidate(client,room,sector)
+            print(f"Failed to capture control at room {room}, sector {sector}")
+            return
+        if quality < MIN_QUALITY:
+            print(f"Rejected control at room {room}, sector {sector}: quality {quality:.2f}")
+            return
         cv2.imwrite(f"imagedata/control/{room}-{id}-{sector}.png", frame)
         print(f"Captured control at room {room}, image ID: {room}-{id}-{sector}")
         # except Exception as e:
@@ -31,9 +48,15 @@ def controlcapture(room:str, sector:int, id:str, days:List[str]):
 def currentcapture(room:str, sector:int, id:str, days:List[str]):
     if datetime.now().strftime("%A") in days:
         # try:
-        cap = cv2.VideoCapture(detectapi.getCamLink(client,room,sector)["link"]) #IP Camera
-        ret, frame = cap.read()
-        frame = cv2.resize(frame,(1024, 576))
+        link, resolution = registry.source(client,room,sector) #IP Camera
+        frame, quality = cameras.read_best(link, resolution=resolution) if link else (None, 0.0)
+        if frame is None:
+            registry.invalidate(client,room,sector)
+            print(f"Failed to capture current at room {room}, sector {sector}")
+            return
+        if quality < MIN_QUALITY:
+            print(f"Rejected current at room {room}, sector {sector}: quality {quality:.2f}")
+            return
         cv2.imwrite(f"imagedata/captures/{room}-{id}-{sector}.png", frame)
         print(f"Captured current at room {room}, image ID: {room}-{id}-{sector}")
         # except Exception as e:
@@ -62,15 +85,15 @@ def sendhighlightcall(control,current, sectors, client, room, days):
 for i in scheduleraw:
     controlID = str(uuid.uuid4())
     for sector in i["sectors"]:
-        schedule.every().day.at(time.fromisoformat(i["start"]).strftime("%H:%M")).do(controlcapture,room=i["room"], sector = sector, id= controlID, days = i["days"] )
+        scheduler.add(f"{i["room"]}-{controlID}-{sector}", daily_at(i["start"], i["days"]), partial(controlcapture,room=i["room"], sector = sector, id= controlID, days = i["days"] ))
     currentID = str(uuid.uuid4())
     for sector in i["sectors"]:
-        schedule.every().day.at(time.fromisoformat(i["end"]).strftime("%H:%M")).do(currentcapture,room=i["room"], sector = sector, id= currentID, days = i["days"] )
+        scheduler.add(f"{i["room"]}-{currentID}-{sector}", daily_at(i["end"], i["days"]), partial(currentcapture,room=i["room"], sector = sector, id= currentID, days = i["days"] ))
     # Convert to datetime (using a dummy date)
     detectdatetime = datetime.combine(datetime.min.date(), time.fromisoformat(i["end"]))
     # Add 5 seconds
     detecttime = detectdatetime + timedelta(seconds=5)
-    schedule.every().day.at(detecttime.time().strftime("%H:%M")).do(sendhighlightcall, control = f"{i["room"]}-{controlID}",current = f"{i["room"]}-{currentID}", sectors= i["sectors"], client = client, room = i["room"], days = i["days"])
+    scheduler.add(f"{i["room"]}-{currentID}-detect", daily_at(detecttime.time(), i["days"]), partial(sendhighlightcall, control = f"{i["room"]}-{controlID}",current = f"{i["room"]}-{currentID}", sectors= i["sectors"], client = client, room = i["room"], days = i["days"]))
 
     # controlID = str(uuid.uuid4())
     # for sector in i["sectors"]:
@@ -84,5 +107,4 @@ for i in scheduleraw:
     # detecttime = detectdatetime + timedelta(seconds=5)
     # sendhighlightcall(control = f"{i["room"]}-{controlID}",current = f"{i["room"]}-{currentID}", sectors= i["sectors"], client = client, room = i["room"], days = i["days"])
 
-while True:
-    schedule.run_pending()
\ No newline at end of file
+scheduler.run_forever()
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Defaults for the shared engine used by the scheduler
+MAX_WORKERS = 16
+PER_CAMERA_LIMIT = 1
+SECTOR_TIMEOUT = 30
+# Seconds between checks on the tasks of a batch for their timeout
+POLL_INTERVAL = 0.5
+
+
+class CaptureEngine:
+    """Bounded thread pool that captures many sectors at once.
+
+    Every camera link gets its own semaphore so a single camera is never
+    opened by more than `per_camera_limit` workers, while different
+    cameras are captured in parallel.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_camera_limit=PER_CAMERA_LIMIT, timeout=SECTOR_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="capture")
+        self.per_camera_limit = per_camera_limit
+        self.timeout = timeout
+        self._slots = {}
+        self._slots_lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def camera_slot(self, link):
+        """Hold one of the concurrency slots for a camera link"""
+        with self._slots_lock:
+            slot = self._slots.get(link)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_camera_limit)
+                self._slots[link] = slot
+        with slot:
+            # Time spent queueing for the camera does not count against the task
+            clock = getattr(self._local, "clock", None)
+            if clock is not None:
+                clock["started"] = time.monotonic()
+            yield
+
+    def _timed(self, func, clock):
+        start = clock["started"] = time.monotonic()
+        self._local.clock = clock
+        try:
+            return {"ok": True, "result": func(), "error": None, "latency": time.monotonic() - start}
+        except Exception as e:
+            return {"ok": False, "result": None, "error": str(e), "latency": time.monotonic() - start}
+        finally:
+            self._local.clock = None
+
+    def run_batch(self, label, tasks, timeout=None):
+        """Run a dict of name -> callable in parallel and collect the outcomes.
+
+        Returns a dict of name -> {"ok", "result", "error", "latency"}. The
+        timeout of a task runs from when it gets a worker and, if it takes
+        one, its camera slot, so tasks queued behind others are not cut
+        short. Tasks still running past it are reported as timed out and
+        left to finish in the background so they never hold up the batch.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        clocks = {name: {"started": None} for name in tasks}
+        futures = {name: self.executor.submit(self._timed, func, clocks[name]) for name, func in tasks.items()}
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            started = [clocks[name]["started"] for name in pending if clocks[name]["started"] is not None]
+            if len(started) == len(pending) and all(now - start >= timeout for start in started):
+                break
+            wait([futures[name] for name in pending], timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            pending = {name for name in pending if not futures[name].done()}
+
+        results = {}
+        for name, future in futures.items():
+            if future.done():
+                results[name] = future.result()
+            else:
+                future.cancel()
+                results[name] = {
+                    "ok": False,
+                    "result": None,
+                    "error": f"timed out after {timeout}s",
+                    "latency": time.monotonic() - clocks[name]["started"],
+                }
+
+        for name, outcome in results.items():
+            if outcome["ok"]:
+                logger.info(f"{label} [{name}] finished in {outcome['latency']:.2f}s")
+            else:
+                logger.error(f"{label} [{name}] failed after {outcome['latency']:.2f}s: {outcome['error']}")
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
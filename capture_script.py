@@ -1,17 +1,38 @@
 #!/usr/bin/env python3
 import requests
-import schedule
-import time
 import datetime
 import pymongo
 import os
 import logging
 import json
 import uuid
-import cv2
+import functools
+import threading
+import calendar
+import queue
 from PIL import Image
 import io
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from capture_engine import CaptureEngine
+from camera_pool import CameraPool, MIN_QUALITY, decode_image, frame_quality
+from frame_buffer import FrameBuffer, FrameArchiver
+from thumbnails import Thumbnailer
+from image_store import ImageStore
+from detect_queue import DetectQueue, DetectWorkers, KEEP_FINISHED, discard_snapshots
+from motion_trigger import MotionTrigger
+from event_scheduler import EventScheduler, daily_at, every, every_in_window, in_window, window_opened
+from schedule_sync import ScheduleSync
+from camera_registry import CameraRegistry
+from control_cache import ControlCache
+from baseline import BaselineStore
+import stain_kernel
+import sector_roi
+import rollups
+import detections
+import change_gate
+import registration
+import client_summary
 
 # Set up logging
 logging.basicConfig(
@@ -27,7 +48,8 @@ logger = logging.getLogger("TabSense-Scheduler")
 # MongoDB connection
 try:
     mongocreds = os.getenv("mongocred", "username:password")  # Default credentials for testing
-    client = pymongo.MongoClient(f"mongodb://{mongocreds}@localhost:27017")
+    MONGO_URI = f"mongodb://{mongocreds}@localhost:27017"
+    client = pymongo.MongoClient(MONGO_URI)
     db = client["tablesense"]
     logger.info("Connected to MongoDB")
 except Exception as e:
@@ -37,201 +59,549 @@ except Exception as e:
 # API URL
 API_URL = "http://localhost:8000"
 
-def get_clients():
-    """Get list of all clients from MongoDB collections"""
-    collections = db.list_collection_names()
-    clients = set()
-    
-    for collection in collections:
-        if "-schedule" in collection:
-            clients.add(collection.split("-")[0])
+# Shared capture engine and the pool that runs whole rooms concurrently
+engine = CaptureEngine()
+room_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="room")
+
+# Long-lived camera streams shared by every capture
+cameras = CameraPool()
+
+# Camera links resolved in-process instead of through the /cam endpoint
+registry = CameraRegistry(db)
+
+# "api" sends captures to the /detect endpoint via PNG files, "inprocess"
+# hands frames straight from capture to detection in memory, "queue" writes
+# the PNGs and leaves detection to a pool of worker processes
+DETECT_MODE = os.getenv("TABSENSE_DETECT_MODE", "api")
+# Whether in-process frames are written to imagedata/ after detection
+ARCHIVE_FRAMES = os.getenv("TABSENSE_ARCHIVE_FRAMES", "1") == "1"
+
+# Frames are stored once per distinct content under imagedata/blobs
+thumbnailer = Thumbnailer()
+store = ImageStore(thumbnails=thumbnailer)
+frames = FrameBuffer()
+archiver = FrameArchiver(thumbnails=thumbnailer, store=store)
+
+# Preprocessed controls, each compared against every capture of its schedule window
+controls = ControlCache()
+
+# "baseline" compares captures against a rolling per-sector background
+# instead of a control captured at the start of every schedule window; the
+# /detect endpoint reads control PNGs, so "api" mode keeps window controls
+REFERENCE = "control" if DETECT_MODE == "api" else os.getenv("TABSENSE_REFERENCE", "baseline")
+baselines = BaselineStore() if REFERENCE == "baseline" else None
+
+# Whether captures are aligned to their control before they are compared
+REGISTER_FRAMES = os.getenv("TABSENSE_REGISTER_FRAMES", "1") == "1"
+
+# Whether sectors whose scene has not changed reuse their previous detection
+CHANGE_GATE = os.getenv("TABSENSE_CHANGE_GATE", "1") == "1"
+gate = change_gate.ChangeGate()
+
+# Detection bundles waiting for the workers in "queue" mode
+detection_queue = DetectQueue() if DETECT_MODE == "queue" else None
+# Seconds a capture waits for room in a full queue before its bundle is dropped
+QUEUE_PUT_TIMEOUT = 60
+# How often queue depth is logged, finished bundles purged and workers checked
+QUEUE_METRICS_INTERVAL = datetime.timedelta(minutes=1)
+
+# Daily time when image retention and compaction run
+IMAGE_MAINTENANCE_AT = os.getenv("TABSENSE_IMAGE_MAINTENANCE_AT", "03:00")
+
+# Entries are captured every CAPTURE_INTERVAL between their start and end
+CAPTURE_INTERVAL = datetime.timedelta(minutes=5)
+
+# "schedule" captures every CAPTURE_INTERVAL; "motion" captures a sector once
+# activity in it has been still for MOTION_SETTLE seconds, keeping only a
+# sparse MOTION_FALLBACK_INTERVAL schedule as a safety net
+CAPTURE_TRIGGER = os.getenv("TABSENSE_CAPTURE_TRIGGER", "schedule")
+MOTION_SETTLE = float(os.getenv("TABSENSE_MOTION_SETTLE", "60"))
+MOTION_FALLBACK_INTERVAL = datetime.timedelta(hours=1)
+motion = MotionTrigger(cameras, MOTION_SETTLE) if CAPTURE_TRIGGER == "motion" else None
+
+# How often the per-client room and camera counters are recounted
+SUMMARY_REFRESH_INTERVAL = datetime.timedelta(minutes=5)
+
+# "auto" follows MongoDB change streams when the server is a replica set and
+# falls back to polling; "watch" and "poll" force one or the other
+SCHEDULE_SYNC_MODE = os.getenv("TABSENSE_SCHEDULE_SYNC", "auto")
+
+scheduler = EventScheduler()
+
+# Clients whose indexes have been created since startup
+indexed_clients = set()
+
+def log_failure(name, future):
+    """Log what a task handed to the room pool raised, since nothing waits on its result"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"{name} failed: {future.exception()!r}")
+
+def submit(func, *args):
+    """Run `func` on the room pool, logging any exception it raises"""
+    future = room_executor.submit(func, *args)
+    future.add_done_callback(functools.partial(log_failure, getattr(func, "__name__", repr(func))))
+    return future
+
+def read_frame(camera_link, resolution=None):
+    """Read the best frame a camera offers within the capture budget, as (frame, quality).
+
+    Frames come back at the detector's working resolution.
+    """
+    # Snapshot URLs return a single encoded image
+    if camera_link.startswith(('http://', 'https://')):
+        response = requests.get(camera_link, timeout=10)
+        if response.status_code != 200:
+            logger.error(f"Camera returned {response.status_code}: {camera_link}")
+            return None, 0.0
+        frame = decode_image(response.content)
+        return frame, frame_quality(frame)
     
-    return list(clients)
+    # Local cameras and RTSP streams come from the pool
+    return cameras.read_best(camera_link, resolution=resolution)
 
-def capture_image(camera_link, output_path):
-    """Capture image from camera and save to file"""
+def grab_frame(camera_link, resolution=None):
+    """Capture a frame as (frame, quality); the frame is None on failure"""
     try:
-        # For real implementation, use requests or opencv to capture from camera
-        # This is a simplified placeholder implementation
-        
-        # Approach 1: Using requests for IP cameras with HTTP access
-        if camera_link.startswith(('http://', 'https://')):
-            response = requests.get(camera_link, stream=True, timeout=10)
-            if response.status_code == 200:
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(1024):
-                        f.write(chunk)
-                logger.info(f"Image saved to {output_path}")
-                return True
-        
-        # Approach 2: Using OpenCV for local cameras or RTSP streams
-        else:
-            # Convert string like "0" to integer for local camera
-            try:
-                if camera_link.isdigit():
-                    camera_link = int(camera_link)
-            except:
-                pass
-                
-            cap = cv2.VideoCapture(camera_link)
-            if not cap.isOpened():
-                logger.error(f"Failed to open camera: {camera_link}")
-                return False
-                
-            ret, frame = cap.read()
-            if ret:
-                cv2.imwrite(output_path, frame)
-                cap.release()
-                logger.info(f"Image saved to {output_path}")
-                return True
-            else:
-                cap.release()
-                logger.error("Failed to capture image")
-                return False
-                
+        frame, quality = read_frame(camera_link, resolution)
+        if frame is None:
+            logger.error(f"Failed to capture image from camera: {camera_link}")
+        return frame, quality
     except Exception as e:
         logger.error(f"Error capturing image: {str(e)}")
-        return False
+        return None, 0.0
+
+def save_detection(client, room, control_uuid, current_uuid, found, unchanged=(), quality=None):
+    """Store an in-process detection result in the room's collection and roll it up"""
+    detections.save(db, client, room, control_uuid, current_uuid, found, unchanged, quality)
+
+def api_boxes(sectors, result):
+    """Stain boxes per sector from a /detect result, which only lists the sectors with stains.
+
+    The API returns a highlighted image per sector rather than boxes, so a
+    listed sector without boxes gets one empty box: a single detection
+    whose position is unknown.
+    """
+    return {sector: (result[str(sector)].get("boxes") or [[]]) if result.get(str(sector)) else []
+            for sector in sectors}
+
+def api_counts(sectors, result):
+    """Detections per sector from a /detect result"""
+    return {sector: len(boxes) for sector, boxes in api_boxes(sectors, result).items()}
 
 def create_capture_job(client, entry):
     """Create a job to capture images based on schedule entry"""
     
-    def job():
-        current_time = datetime.datetime.now().time()
-        current_day = datetime.datetime.now().strftime("%A")
+    # The control of the schedule window being captured, and the sectors it covers
+    window = {"opened": None, "control": None, "sectors": set()}
+    window_lock = threading.Lock()
+    # The stored current image each sector was last compared from, which
+    # captures the change gate finds unchanged are linked to
+    compared = {}
+    opened_at = window_opened(entry['start'], entry['end'], entry.get('days', []))
+    
+    def control_path(sector, control_uuid):
+        """Where the control of a sector is on disk: its PNG, or the snapshot of the sector's baseline"""
+        if baselines is not None:
+            return baselines.snapshot_path(control_uuid, sector)
+        return f"imagedata/control/{control_uuid}-{sector}.png"
+    
+    def control_frame(sector, control_uuid):
+        """The preprocessed control of a sector, reloaded from disk if it left the cache"""
+        return controls.get((entry['room'], control_uuid, sector), control_path(sector, control_uuid))
+    
+    def align(sector, control, current):
+        """Register a capture to its control, starting from the sector's last alignment"""
+        previous = registry.transform(client, entry['room'], sector)
+        current, transform = registration.align(control, current, previous)
+        registry.set_transform(client, entry['room'], sector, transform)
+        return current
+    
+    def capture_sector(sector, control_uuid, current_uuid, need_control):
+        """Capture the current image of a single sector, and its control if the window has none yet.
+
+        With a rolling baseline the sector's background is the control and
+        learns from the capture instead.
+
+        Once the sector is ready for detection, returns the change-gate
+        signatures of the control and current frames and the lower of their
+        quality scores; returns None if the control is missing or the frame
+        scored below MIN_QUALITY.
+        """
+        # Resolve the camera link, preferring its substream, from the in-process registry
+        camera_link, resolution = registry.source(client, entry['room'], sector)
+        if camera_link is None:
+            raise RuntimeError(f"Failed to get camera info for room {entry['room']}, sector {sector}")
         
-        # Check if today is in the scheduled days
-        if current_day not in entry.get('days', []):
-            logger.info(f"Skipping job for {entry['label']} - not scheduled for {current_day}")
-            return
-            
-        # Generate UUIDs for this capture session
-        control_uuid = str(uuid.uuid4())
-        current_uuid = str(uuid.uuid4())
+        with engine.camera_slot(camera_link):
+            current, current_quality = grab_frame(camera_link, resolution)
+        if current is None:
+            # The link may have changed, so look it up again next time
+            registry.invalidate(client, entry['room'], sector)
+            raise RuntimeError(f"Failed to capture image for {entry['room']}, sector {sector}")
+        if current_quality < MIN_QUALITY:
+            logger.warning(f"Skipping {entry['room']}, sector {sector} this run: "
+                           f"frame quality {current_quality:.2f} is below {MIN_QUALITY}")
+            return None
         
-        # Create directories if they don't exist
-        os.makedirs("imagedata/control", exist_ok=True)
-        os.makedirs("imagedata/captures", exist_ok=True)
+        if baselines is not None:
+            # Compare against the background as it was before this capture, then learn from it
+            key = (client, entry['room'], sector)
+            control = baselines.reference(key)
+            if control is not None and REGISTER_FRAMES:
+                current = align(sector, control, current)
+            updated = baselines.update(key, current, table_region(sector))
+            control = controls.add((entry['room'], control_uuid, sector), control or updated)
+            if DETECT_MODE == "queue":
+                # Workers must see the background this capture is compared against, not a later one
+                baselines.snapshot(control, control_uuid, sector)
+        elif need_control:
+            # The first capture of the window doubles as its control
+            control = controls.put((entry['room'], control_uuid, sector), current, current_quality)
+            # Later captures are aligned to this view, not to the last control's
+            registry.set_transform(client, entry['room'], sector, None)
+            control_path = f"imagedata/control/{control_uuid}-{sector}.png"
+            if DETECT_MODE != "inprocess":
+                store.put(control_path, current, capture_id=control_uuid, sector=sector)
+            elif ARCHIVE_FRAMES:
+                archiver.save(control_path, current, control_uuid, sector)
+            with window_lock:
+                window["sectors"].add(sector)
+            logger.info(f"Captured control image for {entry['room']}, sector {sector}")
+        else:
+            control = control_frame(sector, control_uuid)
+            if control is None:
+                # Evicted and never written to disk, so capture a new one next run
+                with window_lock:
+                    window["sectors"].discard(sector)
+                return None
+            if REGISTER_FRAMES:
+                # Undo camera drift since the control so only real changes differ
+                current = align(sector, control, current)
         
-        # Process each sector
-        for sector in entry.get('sectors', []):
-            try:
-                # Get camera information
-                camera_response = requests.get(
-                    f"{API_URL}/cam",
-                    params={
-                        "client": client,
-                        "room": entry['room'],
-                        "sector": sector
-                    }
-                )
-                
-                if camera_response.status_code != 200:
-                    logger.error(f"Failed to get camera info for room {entry['room']}, sector {sector}")
-                    continue
-                
-                camera_info = camera_response.json()
-                camera_link = camera_info['link']
-                
-                # If we're in the control time window, capture control image
-                if datetime.time.fromisoformat(entry['start']) <= current_time <= datetime.time.fromisoformat(entry['end']):
-                    control_path = f"imagedata/control/{control_uuid}-{sector}.png"
-                    if capture_image(camera_link, control_path):
-                        logger.info(f"Captured control image for {entry['room']}, sector {sector}")
-                    else:
-                        logger.error(f"Failed to capture control image for {entry['room']}, sector {sector}")
-                
-                # Always capture current image
-                current_path = f"imagedata/captures/{current_uuid}-{sector}.png"
-                if capture_image(camera_link, current_path):
-                    logger.info(f"Captured current image for {entry['room']}, sector {sector}")
+        # The sector is ready for detection once it has a control and a current image
+        if DETECT_MODE == "inprocess":
+            # Keep the frame in memory for the detection stage
+            frames.put(current_uuid, sector, current)
+        else:
+            current_path = f"imagedata/captures/{current_uuid}-{sector}.png"
+            store.put(current_path, current, capture_id=current_uuid, sector=sector)
+            logger.info(f"Image saved to {current_path} (quality {current_quality:.2f})")
+        logger.info(f"Captured current image for {entry['room']}, sector {sector}")
+        return {
+            "signatures": (control.signature, change_gate.signature(current)),
+            "quality": current_quality if control.quality is None else min(control.quality, current_quality),
+        }
+    
+    def detect_room(sectors, control_uuid, current_uuid):
+        """Run a single batched detection over every captured sector of the room"""
+        try:
+            # Prepare parameters for detection
+            detect_params = {
+                "control": control_uuid,
+                "current": current_uuid,
+                "sectors": sectors,
+                "client": client,
+                "room": entry['room'],
+                "crop": True,
+                "color": "blue",
+                "shape": "auto",
+                "format": "png"
+            }
+            
+            # Make detection request
+            detect_response = requests.get(f"{API_URL}/detect", params=detect_params)
+            
+            if detect_response.status_code == 200:
+                result = detect_response.json()
+                if result:
+                    logger.info(f"Detection successful for {entry['room']}! Found stains in {len(result)} sectors.")
+                    for sector, data in result.items():
+                        logger.info(f"Stains in {entry['room']}, sector {sector}: {data.get('highlight', '')}")
                 else:
-                    logger.error(f"Failed to capture current image for {entry['room']}, sector {sector}")
-                
-                # Run detection if we have both images
-                if os.path.exists(f"imagedata/control/{control_uuid}-{sector}.png") and \
-                   os.path.exists(f"imagedata/captures/{current_uuid}-{sector}.png"):
-                    try:
-                        # Prepare parameters for detection
-                        detect_params = {
-                            "control": control_uuid,
-                            "current": current_uuid,
-                            "sectors": entry.get('sectors', []),
-                            "client": client,
-                            "room": entry['room'],
-                            "crop": True,
-                            "color": "blue",
-                            "shape": "auto",
-                            "format": "png"
-                        }
-                        
-                        # Make detection request
-                        detect_response = requests.get(f"{API_URL}/detect", params=detect_params)
-                        
-                        if detect_response.status_code == 200:
-                            result = detect_response.json()
-                            if result:
-                                logger.info(f"Detection successful for {entry['room']}! Found stains in {len(result)} sectors.")
-                            else:
-                                logger.info(f"No stains detected in {entry['room']}")
-                        else:
-                            logger.error(f"Detection API error: {detect_response.status_code} - {detect_response.text}")
-                    except Exception as e:
-                        logger.error(f"Error in detection process: {str(e)}")
-                
-            except Exception as e:
-                logger.error(f"Error processing sector {sector} for room {entry['room']}: {str(e)}")
+                    logger.info(f"No stains detected in {entry['room']}")
+                return result
+            else:
+                logger.error(f"Detection API error: {detect_response.status_code} - {detect_response.text}")
+        except Exception as e:
+            logger.error(f"Error in detection process: {str(e)}")
     
-    return job
-
-def setup_schedules():
-    """Set up schedules for all clients and rooms"""
-    # Clear existing jobs
-    schedule.clear()
+    def table_roi(sector):
+        """The sector's table polygon from its camera record, or None for the whole frame"""
+        camera = registry.get(client, entry['room'], sector) or {}
+        try:
+            return sector_roi.parse_roi(camera.get("roi"))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Ignoring invalid table region for {entry['room']}, sector {sector}: {str(e)}")
+            return None
     
-    # Get all clients
-    clients = get_clients()
-    logger.info(f"Found {len(clients)} clients: {clients}")
+    def table_region(sector):
+        """Cached crop rectangle and mask of the sector's table, or None for the whole frame"""
+        return sector_roi.region(table_roi(sector))
     
-    for client in clients:
+    def detect_room_inprocess(sectors, control_uuid, current_uuid, reused=None, quality=None):
+        """Compare the buffered frames of the room without touching disk.
+
+        Sectors in `reused` skip the comparison and keep their previous boxes.
+        Returns the boxes of the sectors that were freshly compared.
+        """
         try:
-            # Get all schedule entries for this client
-            collection_name = f"{client}-schedule"
-            schedule_entries = list(db[collection_name].find({}))
+            reused = reused or {}
+            pairs = [(sector, control_frame(sector, control_uuid), frames.pop(current_uuid, sector))
+                     for sector in list(sectors) + list(reused)]
+            # Frames can be evicted from the buffer under heavy load
+            pairs = [pair for pair in pairs if pair[1] is not None and pair[2] is not None]
+            fresh = [pair for pair in pairs if pair[0] not in reused]
             
-            logger.info(f"Found {len(schedule_entries)} schedule entries for client {client}")
+            # Compare every changed sector of the room in one batched pass
+            detected = {}
+            if fresh:
+                planes = [control.plane for _, control, _ in fresh]
+                currents = [current for _, _, current in fresh]
+                regions = [table_region(sector) for sector, _, _ in fresh]
+                detected = dict(zip([sector for sector, _, _ in fresh], stain_kernel.detect_batch(planes, currents, regions)))
             
-            # Create a job for each entry and schedule it to run every minute
-            # In a real implementation, you might want to schedule less frequently
-            for entry in schedule_entries:
-                job = create_capture_job(client, entry)
-                schedule.every(5).minutes.do(job)
-                logger.info(f"Scheduled job for {entry.get('label', 'Unnamed')} in room {entry.get('room', 'Unknown')}")
+            found = {}
+            for sector, _, current in pairs:
+                boxes = detected[sector] if sector in detected else reused[sector]
+                if boxes:
+                    found[sector] = boxes
+                    logger.info(f"Found {len(boxes)} stains in {entry['room']}, sector {sector}")
                 
+                # Persist the frame afterwards, off the detection path
+                if ARCHIVE_FRAMES:
+                    archiver.save(f"imagedata/captures/{current_uuid}-{sector}.png", current, current_uuid, sector,
+                                  like=compared.get(sector) if sector in reused else None)
+            
+            if found:
+                logger.info(f"Detection successful for {entry['room']}! Found stains in {len(found)} sectors.")
+            else:
+                logger.info(f"No stains detected in {entry['room']}")
+            unchanged = [sector for sector, _, _ in pairs if sector in reused]
+            save_detection(client, entry['room'], control_uuid, current_uuid, found, unchanged, quality)
+            return detected
         except Exception as e:
-            logger.error(f"Error setting up schedules for client {client}: {str(e)}")
+            logger.error(f"Error in detection process: {str(e)}")
+    
+    def enqueue_room(sectors, control_uuid, current_uuid, reused, quality):
+        """Hand the room's images to the detection workers; returns the bundle id, or None if dropped"""
+        bundle = {
+            "client": client,
+            "room": entry['room'],
+            "control": control_uuid,
+            "current": current_uuid,
+            "sectors": sectors,
+            "paths": {
+                str(sector): [control_path(sector, control_uuid),
+                              f"imagedata/captures/{current_uuid}-{sector}.png"]
+                for sector in sectors
+            },
+            "reused": {str(sector): boxes for sector, boxes in reused.items()},
+            "quality": {str(sector): score for sector, score in quality.items()},
+            "rois": {str(sector): table_roi(sector) for sector in sectors},
+        }
+        if baselines is not None:
+            # Baseline snapshots belong to the bundle and go once it is finished with
+            bundle["snapshots"] = [control_path(sector, control_uuid) for sector in list(sectors) + list(reused)]
+        try:
+            return detection_queue.put(bundle, timeout=QUEUE_PUT_TIMEOUT)
+        except queue.Full as e:
+            logger.warning(f"Dropping detection for {entry['room']}: {str(e)}")
+            discard_snapshots(bundle)
+            return None
+    
+    def run_room(sectors=None):
+        # Each schedule window gets one control id; a capture outside any window
+        # gets its own, as does every run compared against the rolling baseline
+        now = datetime.datetime.now()
+        opened = opened_at(now) or now
+        with window_lock:
+            if window["opened"] != opened or baselines is not None:
+                window.update(opened=opened, control=str(uuid.uuid4()), sectors=set())
+            control_uuid, with_control = window["control"], set(window["sectors"])
+        current_uuid = str(uuid.uuid4())
+        
+        # Create directories if they don't exist
+        os.makedirs("imagedata/control", exist_ok=True)
+        os.makedirs("imagedata/captures", exist_ok=True)
+        
+        # Capture every sector of the room (or just the given ones) in parallel
+        tasks = {
+            sector: (lambda sector=sector: capture_sector(sector, control_uuid, current_uuid, sector not in with_control))
+            for sector in (sectors or entry.get('sectors', []))
+        }
+        results = engine.run_batch(f"Room {entry['room']} sector", tasks)
+        
+        captured = sum(1 for outcome in results.values() if outcome["ok"])
+        slowest = max((outcome["latency"] for outcome in results.values()), default=0)
+        logger.info(f"Captured {captured}/{len(results)} sectors for {entry['room']} (slowest {slowest:.2f}s)")
+        
+        # Sectors that have both images, with the signatures and quality of their frames
+        ready = {sector: outcome["result"] for sector, outcome in results.items() if outcome["ok"] and outcome["result"]}
+        quality = {sector: capture["quality"] for sector, capture in ready.items()}
+        
+        # Reuse the last result of sectors whose scene has not changed since it was detected
+        reused = {}
+        if CHANGE_GATE:
+            for sector, capture in ready.items():
+                unchanged, previous = gate.check((client, entry['room'], sector), capture["signatures"])
+                if unchanged and DETECT_MODE == "queue":
+                    # Queued results are looked up by the bundle that produced them
+                    result = detection_queue.result(previous) or {}
+                    unchanged, previous = str(sector) in result, result.get(str(sector))
+                if unchanged:
+                    reused[sector] = previous
+            if reused:
+                logger.info(f"No change in {entry['room']}, sectors {sorted(reused)}; reusing previous results")
+        changed = [sector for sector in ready if sector not in reused]
+        
+        # Detect once for the whole room, over the sectors that changed
+        if ready and DETECT_MODE == "queue":
+            bundle_id = enqueue_room(changed, control_uuid, current_uuid, reused, quality)
+            if bundle_id is not None:
+                for sector in changed:
+                    gate.record((client, entry['room'], sector), ready[sector]["signatures"], bundle_id)
+        elif ready and DETECT_MODE == "inprocess":
+            detected = detect_room_inprocess(changed, control_uuid, current_uuid, reused, quality) or {}
+            for sector, boxes in detected.items():
+                gate.record((client, entry['room'], sector), ready[sector]["signatures"], boxes)
+        else:
+            if changed:
+                result = detect_room(changed, control_uuid, current_uuid)
+                if result is not None:
+                    for sector in changed:
+                        gate.record((client, entry['room'], sector), ready[sector]["signatures"], result.get(str(sector)))
+                    # The API stores the record itself, but the rollups and counters live here
+                    rollups.record(db, client, entry['room'], api_counts(changed, result), datetime.datetime.now())
+            if reused:
+                # Reused sectors never go to /detect, so merge their previous boxes into this capture's record
+                detections.merge(db, client, entry['room'], control_uuid, current_uuid,
+                                 api_boxes(reused, {str(sector): previous for sector, previous in reused.items()}),
+                                 reused, {sector: quality[sector] for sector in reused})
+        
+        # Unchanged sectors keep the image they were compared from instead of a near-copy
+        if DETECT_MODE != "inprocess":
+            for sector in reused:
+                if sector in compared:
+                    store.alias(f"imagedata/captures/{current_uuid}-{sector}.png", compared[sector],
+                                capture_id=current_uuid, sector=sector)
+        for sector in changed:
+            compared[sector] = f"imagedata/captures/{current_uuid}-{sector}.png"
+        
+        # Drop frames of sectors that never made it to detection
+        for sector in results:
+            frames.pop(current_uuid, sector)
+    
+    def job(sectors=None):
+        current_day = datetime.datetime.now().strftime("%A")
+        
+        # Check if today is in the scheduled days
+        if current_day not in entry.get('days', []):
+            logger.info(f"Skipping job for {entry['label']} - not scheduled for {current_day}")
+            return
+        
+        # Hand the room off so rooms due in the same tick run side by side
+        submit(run_room, sectors)
+    
+    return job
+
+def entry_key(client, entry):
+    """Scheduler key for a schedule entry"""
+    return f"{client}-{entry.get('id', entry.get('_id'))}"
+
+def watch_entry(key, client, entry, job):
+    """Have the motion trigger capture an entry's sectors as they settle; returns False if it cannot.
+
+    Snapshot URLs are not streams, so entries with one stay on the fixed schedule.
+    """
+    sources = {sector: registry.source(client, entry['room'], sector) for sector in entry.get('sectors', [])}
+    if not sources or any(link is None or link.startswith(('http://', 'https://')) for link, _ in sources.values()):
+        motion.unwatch(key)
+        return False
+    motion.watch(key, sources, job, in_window(entry['start'], entry['end'], entry.get('days', [])))
+    return True
+
+def ensure_indexes(client):
+    """Create a client's rollup and summary indexes the first time one of its entries is scheduled"""
+    if client not in indexed_clients:
+        rollups.ensure_indexes(db, client)
+        client_summary.ensure_indexes(db, client)
+        indexed_clients.add(client)
+
+def schedule_entry(client, entry):
+    """Schedule or reschedule the capture job for a single entry"""
+    ensure_indexes(client)
+    key = entry_key(client, entry)
+    job = create_capture_job(client, entry)
+    interval = CAPTURE_INTERVAL
+    if motion is not None and watch_entry(key, client, entry, job):
+        interval = MOTION_FALLBACK_INTERVAL
+    scheduler.add(key, every_in_window(entry['start'], entry['end'], entry.get('days', []), interval), job)
+    logger.info(f"Scheduled job for {entry.get('label', 'Unnamed')} in room {entry.get('room', 'Unknown')}, next run {scheduler.next_fire_times()[key]}")
+    return key
+
+def unschedule_entry(key):
+    """Drop the capture job of a deleted entry"""
+    if motion is not None:
+        motion.unwatch(key)
+    if scheduler.remove(key):
+        logger.info(f"Removed job {key}")
+
+def log_queue_metrics():
+    """Log the detection queue depth and drop bundles finished long ago"""
+    metrics = detection_queue.metrics()
+    detection_queue.purge()
+    logger.info(f"Detection queue: {metrics['pending']} pending, {metrics['running']} running, "
+                f"{metrics['failed']} failed, oldest pending {metrics['oldest_pending']}s")
 
 def main():
     """Main function to run the scheduler"""
     logger.info("Starting TabSense Scheduler")
     
-    # Set up initial schedules
-    setup_schedules()
+    # Load the schedules, then apply only the entries that change
+    sync = ScheduleSync(db, schedule_entry, unschedule_entry, mode=SCHEDULE_SYNC_MODE)
+    sync.start()
     
-    # Add a job to refresh schedules every hour
-    schedule.every(1).hour.do(setup_schedules)
+    # Keep the Home page room and camera counters in step with edits made through the API
+    def refresh_summaries():
+        client_summary.refresh_all(db, sync.clients())
     
-    # Run the scheduler
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Scheduler stopped by user")
-            break
-        except Exception as e:
-            logger.error(f"Error in scheduler loop: {str(e)}")
-            time.sleep(5)  # Wait a bit before retrying
+    submit(refresh_summaries)
+    scheduler.add("client-summary", every(SUMMARY_REFRESH_INTERVAL), functools.partial(submit, refresh_summaries))
+    
+    # Detection runs in worker processes, one per CPU, fed through the queue
+    workers = None
+    if DETECT_MODE == "queue":
+        workers = DetectWorkers(MONGO_URI, db.name)
+        workers.start()
+        scheduler.add("queue-metrics", every(QUEUE_METRICS_INTERVAL), log_queue_metrics)
+        scheduler.add("queue-workers", every(QUEUE_METRICS_INTERVAL), workers.check)
+    
+    # Expire old images, drop blobs nothing refers to any more and baseline
+    # snapshots whose bundle never finished
+    def maintain_images():
+        store.maintain()
+        if baselines is not None:
+            baselines.prune_snapshots(KEEP_FINISHED)
+    
+    scheduler.add("image-maintenance", daily_at(IMAGE_MAINTENANCE_AT, list(calendar.day_name)),
+                  functools.partial(submit, maintain_images))
+    
+    # Sleep until each job is due instead of polling
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Scheduler stopped by user")
+        sync.stop()
+        scheduler.stop()
+        room_executor.shutdown(wait=False, cancel_futures=True)
+        engine.shutdown()
+        if motion is not None:
+            motion.close()
+        cameras.close()
+        archiver.flush()
+        store.close()
+        if workers is not None:
+            workers.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Size frames are reduced to before they are compared
+SIGNATURE_SIZE = (256, 144)
+# Lowest local structural similarity at which a scene still counts as
+# unchanged; a small new stain drops its neighbourhood well below this
+CHANGE_THRESHOLD = 0.9
+# Consecutive reuses after which a full detection is forced anyway
+MAX_REUSE = 12
+
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+
+def signature(frame):
+    """Small grayscale float copy of a frame, cheap to keep and compare"""
+    small = cv2.resize(frame, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small.astype(np.float32)
+
+
+def _blur(x):
+    return cv2.GaussianBlur(x, (7, 7), 1.5)
+
+
+def similarity(a, b):
+    """Lowest local structural similarity (SSIM) between two signatures.
+
+    The minimum rather than the mean, so a change confined to a small
+    patch is not averaged away by the rest of the frame.
+    """
+    mu_a, mu_b = _blur(a), _blur(b)
+    var_a = _blur(a * a) - mu_a * mu_a
+    var_b = _blur(b * b) - mu_b * mu_b
+    cov = _blur(a * b) - mu_a * mu_b
+    index = ((2 * mu_a * mu_b + _C1) * (2 * cov + _C2)) / ((mu_a ** 2 + mu_b ** 2 + _C1) * (var_a + var_b + _C2))
+    return float(index.min())
+
+
+class ChangeGate:
+    """Skips stain detection for sectors whose scene has not changed.
+
+    Keeps the signatures of the frames last sent to detection for each
+    sector, with the result they produced. While new frames stay within
+    `threshold` of those, the stored result is reused instead of running
+    detection again, up to `max_reuse` times in a row.
+    """
+
+    def __init__(self, threshold=CHANGE_THRESHOLD, max_reuse=MAX_REUSE):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        # key -> {"signatures", "result", "reused"}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def check(self, key, signatures):
+        """Return (True, previous result) if the sector is unchanged, else (False, None)"""
+        with self._lock:
+            last = self._last.get(key)
+            if last is None or last["reused"] >= self.max_reuse or len(last["signatures"]) != len(signatures):
+                return False, None
+            if any(similarity(old, new) < self.threshold for old, new in zip(last["signatures"], signatures)):
+                return False, None
+            last["reused"] += 1
+            return True, last["result"]
+
+    def record(self, key, signatures, result):
+        """Remember the frames a fresh detection ran on and its result"""
+        with self._lock:
+            self._last[key] = {"signatures": signatures, "result": result, "reused": 0}
+
+    def forget(self, key):
+        with self._lock:
+            self._last.pop(key, None)
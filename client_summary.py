@@ -0,0 +1,83 @@
+import datetime
+import logging
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# One counter document per client, keyed by client name
+SUMMARY_COLLECTION = "client-summary"
+# Days of per-day detection counts kept on each summary document
+RETAIN_DAYS = 31
+
+
+def _day(value=None):
+    return (value or datetime.datetime.now()).strftime("%Y-%m-%d")
+
+
+def add_detections(db, client, count, timestamp=None):
+    """Add a stored capture's detections to the client's count for that day"""
+    db[SUMMARY_COLLECTION].update_one(
+        {"_id": client},
+        {"$inc": {f"detections.{_day(timestamp)}": count}},
+        upsert=True,
+    )
+
+
+def ensure_indexes(db, client):
+    db[f"{client}-schedule"].create_index("room")
+
+
+def refresh_counts(db, client):
+    """Recount a client's rooms and cameras and drop day counts past retention"""
+    schedule = db[f"{client}-schedule"]
+    counts = {
+        "rooms": len([room for room in schedule.distinct("room") if room]),
+        "cameras": db[f"{client}-cameras"].count_documents({}),
+        "updated": datetime.datetime.now(),
+    }
+    update = {"$set": counts}
+
+    oldest = _day(datetime.datetime.now() - datetime.timedelta(days=RETAIN_DAYS))
+    doc = db[SUMMARY_COLLECTION].find_one({"_id": client}, {"detections": 1}) or {}
+    expired = {f"detections.{day}": "" for day in doc.get("detections", {}) if day < oldest}
+    if expired:
+        update["$unset"] = expired
+
+    db[SUMMARY_COLLECTION].update_one({"_id": client}, update, upsert=True)
+    return counts
+
+
+def _overview(doc, day):
+    return {
+        "client": doc["_id"],
+        "rooms": doc.get("rooms", 0),
+        "cameras": doc.get("cameras", 0),
+        "detections_today": doc.get("detections", {}).get(day, 0),
+    }
+
+
+def overview(db, client=None):
+    """Room count, camera count and today's detections for one client, or for all of them.
+
+    Reads only the maintained counters: one lookup by _id for a single
+    client, one scan of the summary collection for every client. Read by
+    the dashboard's Home page.
+    """
+    day = _day()
+    projection = {"rooms": 1, "cameras": 1, f"detections.{day}": 1}
+    if client is None:
+        return [_overview(doc, day) for doc in db[SUMMARY_COLLECTION].find({}, projection).sort("_id", 1)]
+
+    doc = db[SUMMARY_COLLECTION].find_one({"_id": client}, projection)
+    if doc is None or "rooms" not in doc:
+        refresh_counts(db, client)
+        doc = db[SUMMARY_COLLECTION].find_one({"_id": client}, projection)
+    return _overview(doc, day)
+
+
+def refresh_all(db, clients):
+    """Refresh the counters of every client; run periodically to catch edits made elsewhere"""
+    for client in clients:
+        try:
+            refresh_counts(db, client)
+        except Exception as e:
+            logger.error(f"Error refreshing summary for client {client}: {str(e)}")
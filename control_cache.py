@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import change_gate
+import stain_kernel
+from camera_pool import fit
+
+# Control frames kept preprocessed; each takes about 1.5 MB
+CONTROL_CACHE_SIZE = int(os.getenv("TABSENSE_CONTROL_CACHE", "128"))
+# Halvings of the blurred plane kept for coarse comparisons
+PYRAMID_LEVELS = 3
+# Keypoints detected on a control when they are first asked for
+MAX_KEYPOINTS = 1000
+
+
+class ControlFrame:
+    """Everything a comparison needs from one control capture, computed once.
+
+    Holds the greyscale frame, the blurred plane `stain_kernel` compares
+    against, its downsampled pyramid and the change-gate signature.
+    Alignment keypoints are only detected the first time they are asked for.
+    """
+
+    def __init__(self, frame, quality=None):
+        frame = fit(frame)
+        self.gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.plane = cv2.GaussianBlur(self.gray, stain_kernel.BLUR_SIZE, 0)
+        self.pyramid = [self.plane]
+        for _ in range(PYRAMID_LEVELS - 1):
+            self.pyramid.append(cv2.pyrDown(self.pyramid[-1]))
+        self.signature = change_gate.signature(self.gray)
+        self.quality = quality
+        self._keypoints = None
+        self._lock = threading.Lock()
+
+    def keypoints(self):
+        """ORB keypoints and descriptors of the control"""
+        with self._lock:
+            if self._keypoints is None:
+                self._keypoints = cv2.ORB_create(MAX_KEYPOINTS).detectAndCompute(self.gray, None)
+            return self._keypoints
+
+
+class ControlCache:
+    """LRU of preprocessed controls keyed by (room, control id, sector).
+
+    A control is captured once per schedule window and compared against
+    every later capture in it, so each comparison only pays for the
+    current frame. Evicted controls are reloaded from their PNG on demand.
+    """
+
+    def __init__(self, capacity=CONTROL_CACHE_SIZE):
+        self.capacity = capacity
+        self._controls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, frame, quality=None):
+        return self.add(key, ControlFrame(frame, quality))
+
+    def add(self, key, control):
+        """Cache an already built ControlFrame"""
+        with self._lock:
+            self._controls[key] = control
+            self._controls.move_to_end(key)
+            while len(self._controls) > self.capacity:
+                self._controls.popitem(last=False)
+        return control
+
+    def get(self, key, path=None):
+        """The cached control for `key`, loading it from `path` on a miss; None if neither has it.
+
+        `path` is a control image, or the .npy of a rolling baseline.
+        """
+        with self._lock:
+            control = self._controls.get(key)
+            if control is not None:
+                self._controls.move_to_end(key)
+                return control
+        if not path or not os.path.exists(path):
+            return None
+        if path.endswith(".npy"):
+            frame = np.round(np.load(path).astype(np.float32)).astype(np.uint8)
+        else:
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        return None if frame is None else self.put(key, frame)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._controls
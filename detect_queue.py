@@ -0,0 +1,311 @@
+import json
+import logging
+import os
+import queue
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+import pymongo
+
+import detections
+from control_cache import ControlCache
+import sector_roi
+import stain_kernel
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Where queued detection bundles are persisted
+QUEUE_PATH = os.getenv("TABSENSE_QUEUE_PATH", "imagedata/detect_queue.sqlite3")
+# Bundles waiting or running before enqueueing blocks
+MAX_DEPTH = int(os.getenv("TABSENSE_QUEUE_DEPTH", "256"))
+# Seconds an idle worker sleeps between looks at the queue
+POLL_INTERVAL = 0.5
+# Attempts before a bundle is marked failed
+MAX_ATTEMPTS = 3
+# Seconds a running bundle may go without finishing before it is handed out again
+STALE_AFTER = 600
+# Seconds finished bundles are kept for results and metrics
+KEEP_FINISHED = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bundle TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id);
+"""
+
+
+class DetectQueue:
+    """Persistent FIFO of detection bundles in a local SQLite file.
+
+    The scheduler `put`s bundles and worker processes `claim` them, so a
+    slow detection never holds up capture. `put` blocks while `max_depth`
+    bundles are outstanding. Every process opens its own connection.
+    """
+
+    def __init__(self, path=QUEUE_PATH, max_depth=MAX_DEPTH):
+        self.path = path
+        self.max_depth = max_depth
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def outstanding(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+
+    def put(self, bundle, timeout=None):
+        """Enqueue a bundle and return its id; raises queue.Full if no room frees up in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.outstanding() >= self.max_depth:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Full(f"Detection queue has {self.max_depth} bundles outstanding")
+            time.sleep(POLL_INTERVAL)
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (bundle, created) VALUES (?, ?)", (json.dumps(bundle), time.time())
+        )
+        return cursor.lastrowid
+
+    def claim(self):
+        """Take the oldest pending bundle as {"id", "bundle", "attempts"}, or None if there is none"""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, bundle, attempts FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1 WHERE id = ?",
+                    (time.time(), row["id"]),
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"id": row["id"], "bundle": json.loads(row["bundle"]), "attempts": row["attempts"] + 1}
+
+    def complete(self, job_id, result):
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id, error):
+        """Put a bundle back for another attempt, or mark it failed after MAX_ATTEMPTS"""
+        self._connect().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, finished = ? WHERE id = ?",
+            (MAX_ATTEMPTS, error, time.time(), job_id),
+        )
+
+    def result(self, job_id):
+        """The result of a finished bundle, or None while it is pending, running or failed"""
+        row = self._connect().execute(
+            "SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)
+        ).fetchone()
+        return None if row is None else json.loads(row["result"])
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """Hand out again bundles whose worker died while running them, as (requeued, failed).
+
+        A bundle that already had MAX_ATTEMPTS is marked failed instead, so one
+        that kills its worker is not retried forever, and its snapshots are
+        discarded.
+        """
+        db = self._connect()
+        cutoff = time.time() - stale_after
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            dead = db.execute(
+                "SELECT id, bundle FROM jobs WHERE status = 'running' AND started < ? AND attempts >= ?",
+                (cutoff, MAX_ATTEMPTS),
+            ).fetchall()
+            db.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'worker stopped responding', finished = ? WHERE id = ?",
+                [(time.time(), row["id"]) for row in dead],
+            )
+            requeued = db.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running' AND started < ?", (cutoff,)
+            ).rowcount
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        for row in dead:
+            discard_snapshots(json.loads(row["bundle"]))
+        return requeued, len(dead)
+
+    def purge(self, keep=KEEP_FINISHED):
+        """Delete finished and failed bundles older than `keep` seconds"""
+        return self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+            (time.time() - keep,),
+        ).rowcount
+
+    def metrics(self):
+        """Bundle counts per status and the age in seconds of the oldest pending one"""
+        db = self._connect()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({row["status"]: row["n"] for row in
+                       db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")})
+        oldest = db.execute("SELECT MIN(created) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        counts["oldest_pending"] = 0 if oldest is None else round(time.time() - oldest, 1)
+        return counts
+
+
+def discard_snapshots(bundle):
+    """Remove the baseline snapshots a bundle was compared against once it is finished with"""
+    for path in bundle.get("snapshots", []):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def process_bundle(db, bundle, cache=None):
+    """Detect stains for one captured room and store the result; returns boxes per sector.
+
+    Controls come preprocessed from `cache` when one is given, so a worker
+    decodes each control once per schedule window.
+    """
+    cache = cache if cache is not None else ControlCache(capacity=0)
+    sectors, controls, currents, regions = [], [], [], []
+    for sector in bundle["sectors"]:
+        control = cache.get((bundle["room"], bundle["control"], sector), bundle["paths"][str(sector)][0])
+        current = cv2.imread(bundle["paths"][str(sector)][1], cv2.IMREAD_COLOR)
+        if control is None or current is None:
+            logger.error(f"Missing images for {bundle['room']}, sector {sector}")
+            continue
+        sectors.append(sector)
+        controls.append(control.plane)
+        currents.append(current)
+        regions.append(sector_roi.region(bundle.get("rois", {}).get(str(sector))))
+
+    detected = dict(zip(sectors, stain_kernel.detect_batch(controls, currents, regions))) if sectors else {}
+    reused = {int(sector): boxes for sector, boxes in bundle.get("reused", {}).items()}
+    found = {sector: boxes for sector, boxes in {**reused, **detected}.items() if boxes}
+    detections.save(db, bundle["client"], bundle["room"], bundle["control"], bundle["current"], found, reused,
+                    bundle.get("quality"))
+    return {str(sector): [list(box) for box in boxes] for sector, boxes in detected.items()}
+
+
+def run_worker(path=QUEUE_PATH, mongo_uri=None, db_name="tablesense", name="detect"):
+    """Claim and process bundles until SIGTERM or SIGINT"""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    dq = DetectQueue(path)
+    db = pymongo.MongoClient(mongo_uri)[db_name]
+    cache = ControlCache()
+    while not stop.is_set():
+        job = dq.claim()
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        started = time.monotonic()
+        try:
+            result = process_bundle(db, job["bundle"], cache)
+            dq.complete(job["id"], result)
+            discard_snapshots(job["bundle"])
+            logger.info(f"{name} finished bundle {job['id']} for {job['bundle']['room']} "
+                        f"in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"{name} failed bundle {job['id']} (attempt {job['attempts']}): {str(e)}")
+            dq.fail(job["id"], str(e))
+            if job["attempts"] >= MAX_ATTEMPTS:
+                discard_snapshots(job["bundle"])
+
+
+class DetectWorkers:
+    """Pool of worker processes draining a DetectQueue, one per CPU by default.
+
+    Workers are separate interpreters running this module, so they share
+    nothing with the scheduler but the queue file and the database. `check`
+    restarts workers that died and hands their stuck bundles out again.
+    """
+
+    def __init__(self, mongo_uri, db_name, path=QUEUE_PATH, processes=None):
+        self.mongo_uri = mongo_uri
+        self.db_name = db_name
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self._queue = None
+        self._workers = []
+
+    def _spawn(self, i):
+        env = dict(os.environ, TABSENSE_MONGO_URI=self.mongo_uri, TABSENSE_MONGO_DB=self.db_name,
+                   TABSENSE_QUEUE_PATH=self.path)
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), f"detect-{i}"], env=env)
+
+    def start(self):
+        self._queue = DetectQueue(self.path)
+        self._queue.requeue_stale()
+        self._workers = [self._spawn(i) for i in range(self.processes)]
+        logger.info(f"Started {self.processes} detection workers")
+
+    def check(self):
+        """Restart workers that have exited and requeue bundles left running too long"""
+        for i, worker in enumerate(self._workers):
+            if worker.poll() is not None:
+                logger.warning(f"Detection worker detect-{i} exited with code {worker.returncode}; restarting it")
+                self._workers[i] = self._spawn(i)
+        if self._queue is not None:
+            requeued, failed = self._queue.requeue_stale()
+            if requeued:
+                logger.warning(f"Requeued {requeued} detection bundles whose worker stopped responding")
+            if failed:
+                logger.error(f"Gave up on {failed} detection bundles that stopped their worker {MAX_ATTEMPTS} times")
+
+    def stop(self, timeout=10):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(timeout)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("capture.log"),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    run_worker(
+        os.getenv("TABSENSE_QUEUE_PATH", QUEUE_PATH),
+        os.getenv("TABSENSE_MONGO_URI"),
+        os.getenv("TABSENSE_MONGO_DB", "tablesense"),
+        sys.argv[1] if len(sys.argv) > 1 else "detect",
+    )
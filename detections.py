@@ -0,0 +1,50 @@
+import datetime
+import uuid
+
+import rollups
+
+
+def save(db, client, room, control_uuid, current_uuid, found, unchanged=(), quality=None):
+    """Store a detection result in the room's collection and roll it up.
+
+    `found` maps sectors to their stain boxes; `unchanged` lists the sectors
+    whose result was reused because the scene had not changed, and
+    `quality` holds the capture quality score of each captured sector.
+    """
+    timestamp = datetime.datetime.now()
+    doc = {
+        "id": str(uuid.uuid4()),
+        "control": control_uuid,
+        "current": current_uuid,
+        "sectors": {str(sector): [list(box) for box in boxes] for sector, boxes in found.items()},
+        "detections": sum(len(boxes) for boxes in found.values()),
+        "unchanged": sorted(unchanged),
+        "quality": {str(sector): score for sector, score in (quality or {}).items()},
+        "timestamp": timestamp
+    }
+    db[f"{client}-{room}"].insert_one(doc)
+    rollups.record(db, client, room, rollups.capture_counts(doc), timestamp)
+
+
+def merge(db, client, room, control_uuid, current_uuid, found, unchanged=(), quality=None):
+    """Add sectors to the stored record of a capture, creating it if there is none yet, and roll them up.
+
+    In api mode the /detect endpoint stores the record of the sectors it was
+    sent; the sectors reused without detection are merged into it so every
+    capture keeps a single record.
+    """
+    timestamp = datetime.datetime.now()
+    sectors = {str(sector): [list(box) for box in boxes] for sector, boxes in found.items()}
+    scores = {str(sector): score for sector, score in (quality or {}).items()}
+    fields = {**{f"sectors.{sector}": boxes for sector, boxes in sectors.items()},
+              **{f"quality.{sector}": score for sector, score in scores.items()}}
+    update = {
+        "$setOnInsert": {"id": str(uuid.uuid4()), "control": control_uuid, "timestamp": timestamp},
+        "$inc": {"detections": sum(len(boxes) for boxes in sectors.values())},
+        "$addToSet": {"unchanged": {"$each": sorted(unchanged)}},
+    }
+    if fields:
+        update["$set"] = fields
+    db[f"{client}-{room}"].update_one({"current": current_uuid}, update, upsert=True)
+    rollups.record(db, client, room,
+                   rollups.capture_counts({"sectors": sectors, "unchanged": unchanged, "quality": scores}), timestamp)
@@ -1,13 +1,23 @@
 import streamlit as st
-import requests
 import json
 import subprocess
 import pandas as pd
 from datetime import datetime, time
-import os, cv2
+import os, re
 from typing import List, Dict, Any
-from PIL import Image
 import time as timmytime
+import tempfile
+import pymongo
+import pymongo.errors
+from camera_pool import CameraPool
+from preview_service import PreviewService
+from thumbnails import Thumbnailer
+import api_client
+import camera_import
+import client_summary
+import report_export
+import rollups
+import sector_roi
 
 # Configure page
 st.set_page_config(
@@ -17,7 +27,62 @@ st.set_page_config(
 )
 
 # Define API URL
-API_URL = "http://localhost:8000"
+API_URL = api_client.API_URL
+
+# Seconds between refreshes of the camera preview grid while thumbnails arrive
+PREVIEW_REFRESH = 2
+# Cameras previewed at once; each keeps a stream open in the dashboard process
+PREVIEW_PAGE_SIZE = 9
+# Seconds a preview stream stays open after its last thumbnail
+PREVIEW_IDLE_TIMEOUT = 60
+
+@st.cache_resource
+def camera_pool() -> CameraPool:
+    """Camera streams shared across reruns and sessions so previews skip the RTSP handshake"""
+    return CameraPool(idle_timeout=PREVIEW_IDLE_TIMEOUT)
+
+@st.cache_resource
+def preview_service() -> PreviewService:
+    """Background thumbnail fetcher shared by every session"""
+    return PreviewService(camera_pool())
+
+@st.cache_resource
+def thumbnailer() -> Thumbnailer:
+    """Preview derivatives of detection images, shared by every session"""
+    return Thumbnailer()
+
+# Milliseconds the dashboard waits for MongoDB before showing a page without it
+DATABASE_TIMEOUT_MS = 2000
+
+@st.cache_resource
+def database():
+    """The scheduler's database, read for the rollups and counters it maintains"""
+    mongocreds = os.getenv("mongocred", "username:password")
+    return pymongo.MongoClient(f"mongodb://{mongocreds}@localhost:27017",
+                               serverSelectionTimeoutMS=DATABASE_TIMEOUT_MS)["tablesense"]
+
+@st.cache_data(ttl=api_client.CACHE_TTL, show_spinner=False)
+def client_overview(client: str = None):
+    """Maintained room, camera and detection counters of a client, or of every client; None if unreachable"""
+    try:
+        return client_summary.overview(database(), client)
+    except pymongo.errors.PyMongoError:
+        # Cached like a result, so an unreachable database is not retried on every rerun
+        return None
+
+@st.cache_data(ttl=api_client.CACHE_TTL, show_spinner=False)
+def report_summary(client: str, room: str, start: datetime, end: datetime, granularity: str):
+    """Totals of a room per period and per sector, read from the pre-rolled aggregates"""
+    return rollups.summary(database(), client, room, start, end, granularity)
+
+@st.cache_data(ttl=api_client.CACHE_TTL, show_spinner=False)
+def report_records(client: str, room: str, start: datetime, end: datetime, page: int):
+    """One page of a room's raw detection records, newest first"""
+    return rollups.records(database(), client, room, start, end, page)
+
+
+ROI_HELP = ("Corners of the table surface as [x, y] fractions of the frame width and height. "
+            "Detection only looks inside it; leave empty to use the whole frame.")
 
 # Define sidebar navigation
 # st.sidebar.title("TabSense Dashboard")
@@ -78,47 +143,35 @@ if page == "Home":
     Use the sidebar to navigate through different features.
     """)
     
-    # Quick stats if a client is selected
+    # Quick stats if a client is selected, read from the counters the scheduler maintains
     if st.session_state.client:
         st.subheader(f"Quick Stats for {st.session_state.client}")
         col1, col2, col3 = st.columns(3)
         
-        try:
-            # Get room count
-            rooms_response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
-            if rooms_response.status_code == 200:
-                entries = rooms_response.json()
-                unique_rooms = set(entry.get("room", "") for entry in entries)
-                room_count = len(unique_rooms)
-            else:
-                room_count = "N/A"
-                
-            # Get camera count
-            try:
-                cameras_response = requests.get(f"{API_URL}/cam", params={"client": st.session_state.client})
-                if cameras_response.status_code == 200:
-                    cameras = cameras_response.json()
-                    if isinstance(cameras, list):
-                        camera_count = len(cameras)
-                    else:
-                        camera_count = 1  # Single camera returned
-                else:
-                    camera_count = "N/A"
-            except:
-                camera_count = "N/A"
-                
-            # For detection count, we'd need to query each room's collection or have a summary endpoint
-            # This is a placeholder
-            detections_count = "N/A"
-            
+        stats = client_overview(st.session_state.client)
+        if stats is None:
+            st.warning("Could not fetch client statistics: the database is unreachable")
+        else:
             with col1:
-                st.metric("Total Rooms", room_count)
+                st.metric("Total Rooms", stats["rooms"])
             with col2:
-                st.metric("Active Cameras", camera_count)
+                st.metric("Active Cameras", stats["cameras"])
             with col3:
-                st.metric("Detections Today", detections_count)
-        except Exception as e:
-            st.warning(f"Could not fetch client statistics: {str(e)}")
+                st.metric("Detections Today", stats["detections_today"])
+    else:
+        # Overview of every client from the same counters
+        overview = client_overview()
+        if overview is None:
+            st.warning("Could not fetch client overview: the database is unreachable")
+        elif overview:
+            st.subheader("Clients Overview")
+            st.dataframe(
+                pd.DataFrame(overview).rename(columns={
+                    "client": "Client", "rooms": "Rooms", "cameras": "Cameras",
+                    "detections_today": "Detections Today",
+                }),
+                hide_index=True, use_container_width=True
+            )
 
 # Detection Page
 elif page == "Detection":
@@ -136,13 +189,8 @@ elif page == "Detection":
             
             # Get rooms from schedule entries
             try:
-                response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
-                if response.status_code == 200:
-                    entries = response.json()
-                    unique_rooms = sorted(set(entry.get("room", "") for entry in entries))
-                    room = st.selectbox("Room", [""] + list(unique_rooms))
-                else:
-                    room = st.text_input("Room")
+                unique_rooms = api_client.rooms(st.session_state.client)
+                room = st.selectbox("Room", [""] + list(unique_rooms))
             except:
                 room = st.text_input("Room")
             
@@ -150,14 +198,7 @@ elif page == "Detection":
             sectors = []
             if room:
                 try:
-                    cam_response = requests.get(f"{API_URL}/cam", 
-                                               params={"client": st.session_state.client, "room": room})
-                    if cam_response.status_code == 200:
-                        cameras = cam_response.json()
-                        if isinstance(cameras, list):
-                            sectors = sorted(set(cam.get("sector", 1) for cam in cameras))
-                        elif isinstance(cameras, dict):
-                            sectors = [cameras.get("sector", 1)]
+                    sectors = api_client.sectors(st.session_state.client, room)
                 except:
                     pass
             
@@ -200,28 +241,40 @@ elif page == "Detection":
                     }
                     
                     # Make API request
-                    response = requests.get(f"{API_URL}/detect", params=payload)
+                    response = api_client.detect(payload)
                     
                     if response.status_code == 200:
-                        result = response.json()
-                        
-                        if result:
-                            st.success(f"Detection completed! Found stains in {len(result)} sectors.")
-                            
-                            # Display results
-                            for sector, data in result.items():
-                                st.subheader(f"Sector {sector}")
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    st.image(f"imagedata/control/{data['control']}", caption="Control Image", width=300)
-                                with col2:
-                                    st.image(f"{data['highlight']}", caption="Highlighted Stains", width=300)
-                        else:
-                            st.info("No stains detected!")
+                        # Kept so the full-resolution toggles survive reruns
+                        st.session_state.detection_result = response.json()
                     else:
                         st.error(f"Error: {response.status_code} - {response.text}")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
+        
+        result = st.session_state.get("detection_result")
+        if result is not None:
+            if result:
+                st.success(f"Detection completed! Found stains in {len(result)} sectors.")
+                
+                # Display results as thumbnails, loading full resolution only on request
+                for sector, data in result.items():
+                    st.subheader(f"Sector {sector}")
+                    full = st.toggle("Full resolution", key=f"full_resolution_{sector}")
+                    col1, col2 = st.columns(2)
+                    for column, path, caption in [
+                        (col1, f"imagedata/control/{data['control']}", "Control Image"),
+                        (col2, data["highlight"], "Highlighted Stains"),
+                    ]:
+                        with column:
+                            try:
+                                if full:
+                                    st.image(path, caption=caption)
+                                else:
+                                    st.image(thumbnailer().thumbnail(path), caption=caption, width=300)
+                            except Exception as e:
+                                st.warning(f"{caption} unavailable: {str(e)}")
+            else:
+                st.info("No stains detected!")
 
 # Schedule Page
 elif page == "Schedule":
@@ -237,34 +290,29 @@ elif page == "Schedule":
             
             # Fetch schedule entries
             try:
-                response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
+                entries = api_client.entries(st.session_state.client)
                 
-                if response.status_code == 200:
-                    entries = response.json()
+                if entries:
+                    # Convert to DataFrame for better display
+                    df = pd.DataFrame(entries)
                     
-                    if entries:
-                        # Convert to DataFrame for better display
-                        df = pd.DataFrame(entries)
-                        
-                        # Process time columns for better display
-                        if 'start' in df.columns:
-                            df['start_time'] = df['start'].apply(lambda x: x.split('T')[-1] if 'T' in str(x) else x)
-                        if 'end' in df.columns:
-                            df['end_time'] = df['end'].apply(lambda x: x.split('T')[-1] if 'T' in str(x) else x)
-                        
-                        # Display the schedule
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # Additional filters
-                        with st.expander("Filter Results"):
-                            room_filter = st.text_input("Filter by Room")
-                            if room_filter:
-                                filtered_df = df[df['room'].str.contains(room_filter, case=False)]
-                                st.dataframe(filtered_df, use_container_width=True)
-                    else:
-                        st.info("No schedule entries found")
+                    # Process time columns for better display
+                    if 'start' in df.columns:
+                        df['start_time'] = df['start'].apply(lambda x: x.split('T')[-1] if 'T' in str(x) else x)
+                    if 'end' in df.columns:
+                        df['end_time'] = df['end'].apply(lambda x: x.split('T')[-1] if 'T' in str(x) else x)
+                    
+                    # Display the schedule
+                    st.dataframe(df, use_container_width=True)
+                    
+                    # Additional filters
+                    with st.expander("Filter Results"):
+                        room_filter = st.text_input("Filter by Room")
+                        if room_filter:
+                            filtered_df = df[df['room'].str.contains(room_filter, case=False)]
+                            st.dataframe(filtered_df, use_container_width=True)
                 else:
-                    st.error(f"Error fetching schedule: {response.status_code} - {response.text}")
+                    st.info("No schedule entries found")
             except Exception as e:
                 st.error(f"Error: {str(e)}")
         
@@ -274,16 +322,12 @@ elif page == "Schedule":
             with st.form("add_schedule_form"):
                 # Get existing rooms from API to populate dropdown
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
-                    if response.status_code == 200:
-                        entries = response.json()
-                        unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
-                        room = st.selectbox("Room", [""] + list(unique_rooms) + ["New Room..."], accept_new_options = True)
-                        
-                        if room == "New Room...":
-                            room = st.text_input("Enter New Room Name")
-                    else:
-                        room = st.text_input("Room")
+                    entries = api_client.entries(st.session_state.client)
+                    unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
+                    room = st.selectbox("Room", [""] + list(unique_rooms) + ["New Room..."], accept_new_options = True)
+                    
+                    if room == "New Room...":
+                        room = st.text_input("Enter New Room Name")
                 except:
                     room = st.text_input("Room")
                 
@@ -301,14 +345,11 @@ elif page == "Schedule":
                 sectors = []
                 if room and room != "New Room...":
                     try:
-                        cam_response = requests.get(f"{API_URL}/cam", 
-                                                   params={"client": st.session_state.client, "room": room})
-                        if cam_response.status_code == 200:
-                            cameras = cam_response.json()
-                            if isinstance(cameras, list):
-                                sectors = sorted(set(cam.get("sector", 1) for cam in cameras))
-                            elif isinstance(cameras, dict):
-                                sectors = [cameras.get("sector", 1)]
+                        cameras = api_client.cameras(st.session_state.client, room)
+                        if isinstance(cameras, list):
+                            sectors = sorted(set(cam.get("sector", 1) for cam in cameras))
+                        elif isinstance(cameras, dict):
+                            sectors = [cameras.get("sector", 1)]
                     except:
                         pass
                 
@@ -344,7 +385,7 @@ elif page == "Schedule":
                         }
                         
                         # Make API request
-                        response = requests.post(f"{API_URL}/entry/add", json=payload)
+                        response = api_client.add_entry(payload)
                         
                         if response.status_code == 200:
                             st.success("Schedule entry added successfully!")
@@ -358,97 +399,81 @@ elif page == "Schedule":
             
             # First, fetch all entries to let user select one
             try:
-                response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
+                entries = api_client.entries(st.session_state.client)
                 
-                if response.status_code == 200:
-                    entries = response.json()
+                if entries:
+                    # Create selection options
+                    entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e for e in entries}
+                    selected_entry_key = st.selectbox("Select Entry to Update", list(entry_options.keys()))
+                    selected_entry = entry_options[selected_entry_key]
                     
-                    if entries:
-                        # Create selection options
-                        entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e for e in entries}
-                        selected_entry_key = st.selectbox("Select Entry to Update", list(entry_options.keys()))
-                        selected_entry = entry_options[selected_entry_key]
+                    with st.form("update_schedule_form"):
+                        # Pre-fill form with current values
+                        room = st.text_input("Room", value=selected_entry["room"])
+                        label = st.text_input("Label", value=selected_entry["label"])
                         
-                        with st.form("update_schedule_form"):
-                            # Pre-fill form with current values
-                            room = st.text_input("Room", value=selected_entry["room"])
-                            label = st.text_input("Label", value=selected_entry["label"])
-                            
-                            # Parse time values
-                            current_start = time.fromisoformat(selected_entry["start"])
-                            current_end = time.fromisoformat(selected_entry["end"])
-                            
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                start_hour = st.number_input("Start Hour", min_value=0, max_value=23, value=current_start.hour)
-                                start_minute = st.number_input("Start Minute", min_value=0, max_value=59, value=current_start.minute)
-                            with col2:
-                                end_hour = st.number_input("End Hour", min_value=0, max_value=23, value=current_end.hour)
-                                end_minute = st.number_input("End Minute", min_value=0, max_value=59, value=current_end.minute)
+                        # Parse time values
+                        current_start = time.fromisoformat(selected_entry["start"])
+                        current_end = time.fromisoformat(selected_entry["end"])
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            start_hour = st.number_input("Start Hour", min_value=0, max_value=23, value=current_start.hour)
+                            start_minute = st.number_input("Start Minute", min_value=0, max_value=59, value=current_start.minute)
+                        with col2:
+                            end_hour = st.number_input("End Hour", min_value=0, max_value=23, value=current_end.hour)
+                            end_minute = st.number_input("End Minute", min_value=0, max_value=59, value=current_end.minute)
+                        
+                        # Get sectors for this room
+                        try:
+                            cameras = api_client.cameras(st.session_state.client, room)
+                            if isinstance(cameras, list):
+                                available_sectors = sorted(set(cam.get("sector", 1) for cam in cameras))
+                            elif isinstance(cameras, dict):
+                                available_sectors = [cameras.get("sector", 1)]
                             
-                            # Get sectors for this room
+                            current_sectors = selected_entry.get("sectors", [])
+                            sectors = st.multiselect("Sectors", available_sectors, default=current_sectors)
+                        except:
+                            current_sectors_str = ",".join(map(str, selected_entry.get("sectors", [])))
+                            sectors_str = st.text_input("Sectors (comma separated numbers)", current_sectors_str)
+                            sectors = [int(s.strip()) for s in sectors_str.split(",")]
+                        
+                        days = st.multiselect(
+                            "Days",
+                            ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+                            default=selected_entry.get("days", [])
+                        )
+                        
+                        submitted = st.form_submit_button("Update Schedule Entry")
+                        
+                        if submitted:
                             try:
-                                cam_response = requests.get(f"{API_URL}/cam", 
-                                                         params={"client": st.session_state.client, "room": room})
-                                if cam_response.status_code == 200:
-                                    cameras = cam_response.json()
-                                    if isinstance(cameras, list):
-                                        available_sectors = sorted(set(cam.get("sector", 1) for cam in cameras))
-                                    elif isinstance(cameras, dict):
-                                        available_sectors = [cameras.get("sector", 1)]
-                                    
-                                    current_sectors = selected_entry.get("sectors", [])
-                                    sectors = st.multiselect("Sectors", available_sectors, default=current_sectors)
+                                # Create time objects
+                                start_time = time(hour=start_hour, minute=start_minute)
+                                end_time = time(hour=end_hour, minute=end_minute)
+                                
+                                # Prepare payload
+                                payload = {
+                                    "room": room,
+                                    "label": label,
+                                    "start": start_time.isoformat(),
+                                    "end": end_time.isoformat(),
+                                    "sectors": sectors,
+                                    "days": days
+                                }
+                                
+                                # Make API request
+                                response = api_client.update_entry(st.session_state.client, selected_entry["id"], payload)
+                                
+                                if response.status_code == 200:
+                                    st.success("Schedule entry updated successfully!")
                                 else:
-                                    current_sectors_str = ",".join(map(str, selected_entry.get("sectors", [])))
-                                    sectors_str = st.text_input("Sectors (comma separated numbers)", current_sectors_str)
-                                    sectors = [int(s.strip()) for s in sectors_str.split(",")]
-                            except:
-                                current_sectors_str = ",".join(map(str, selected_entry.get("sectors", [])))
-                                sectors_str = st.text_input("Sectors (comma separated numbers)", current_sectors_str)
-                                sectors = [int(s.strip()) for s in sectors_str.split(",")]
-                            
-                            days = st.multiselect(
-                                "Days",
-                                ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
-                                default=selected_entry.get("days", [])
-                            )
-                            
-                            submitted = st.form_submit_button("Update Schedule Entry")
-                            
-                            if submitted:
-                                try:
-                                    # Create time objects
-                                    start_time = time(hour=start_hour, minute=start_minute)
-                                    end_time = time(hour=end_hour, minute=end_minute)
-                                    
-                                    # Prepare payload
-                                    payload = {
-                                        "room": room,
-                                        "label": label,
-                                        "start": start_time.isoformat(),
-                                        "end": end_time.isoformat(),
-                                        "sectors": sectors,
-                                        "days": days
-                                    }
-                                    
-                                    # Make API request
-                                    response = requests.post(
-                                        f"{API_URL}/entry/update",
-                                        params={"client": st.session_state.client, "id": selected_entry["id"]},
-                                        json=payload
-                                    )
-                                    
-                                    if response.status_code == 200:
-                                        st.success("Schedule entry updated successfully!")
-                                    else:
-                                        st.error(f"Error: {response.status_code} - {response.text}")
-                                except Exception as e:
-                                    st.error(f"Error: {str(e)}")
-                    else:
-                        st.info("No schedule entries found to update")
+                                    st.error(f"Error: {response.status_code} - {response.text}")
+                            except Exception as e:
+                                st.error(f"Error: {str(e)}")
                 else:
-                    st.error(f"Error fetching schedule: {response.status_code} - {response.text}")
+                    st.info("No schedule entries found to update")
             except Exception as e:
                 st.error(f"Error: {str(e)}")
         
@@ -460,93 +485,68 @@ elif page == "Schedule":
             if delete_option == "Single Entry":
                 # Fetch entries for selection
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
+                    entries = api_client.entries(st.session_state.client)
                     
-                    if response.status_code == 200:
-                        entries = response.json()
+                    if entries:
+                        # Create selection options
+                        entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e["id"] for e in entries}
+                        selected_entry_id = st.selectbox("Select Entry to Delete", list(entry_options.keys()))
+                        entry_id = entry_options[selected_entry_id]
                         
-                        if entries:
-                            # Create selection options
-                            entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e["id"] for e in entries}
-                            selected_entry_id = st.selectbox("Select Entry to Delete", list(entry_options.keys()))
-                            entry_id = entry_options[selected_entry_id]
+                        if st.button("Delete Entry"):
+                            response = api_client.delete_entry(st.session_state.client, entry_id)
                             
-                            if st.button("Delete Entry"):
-                                response = requests.post(
-                                    f"{API_URL}/entry/deleteone",
-                                    params={"id": entry_id, "client": st.session_state.client, "room": ""}
-                                )
-                                
-                                if response.status_code == 200:
-                                    st.success("Entry deleted successfully!")
-                                else:
-                                    st.error(f"Error: {response.status_code} - {response.text}")
-                        else:
-                            st.info("No entries found")
+                            if response.status_code == 200:
+                                st.success("Entry deleted successfully!")
+                            else:
+                                st.error(f"Error: {response.status_code} - {response.text}")
                     else:
-                        st.error(f"Error fetching entries: {response.status_code} - {response.text}")
+                        st.info("No entries found")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
             
             elif delete_option == "Room":
                 # Get room list
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
+                    entries = api_client.entries(st.session_state.client)
                     
-                    if response.status_code == 200:
-                        entries = response.json()
+                    if entries:
+                        # Extract unique rooms
+                        rooms = list(set(e["room"] for e in entries if "room" in e))
+                        selected_room = st.selectbox("Select Room", rooms)
                         
-                        if entries:
-                            # Extract unique rooms
-                            rooms = list(set(e["room"] for e in entries if "room" in e))
-                            selected_room = st.selectbox("Select Room", rooms)
+                        if st.button("Delete All Entries for Room"):
+                            response = api_client.delete_entries(st.session_state.client, room=selected_room)
                             
-                            if st.button("Delete All Entries for Room"):
-                                response = requests.post(
-                                    f"{API_URL}/entry/delete",
-                                    params={"client": st.session_state.client, "room": selected_room}
-                                )
-                                
-                                if response.status_code == 200:
-                                    st.success(f"All entries for room '{selected_room}' deleted!")
-                                else:
-                                    st.error(f"Error: {response.status_code} - {response.text}")
-                        else:
-                            st.info("No entries found")
+                            if response.status_code == 200:
+                                st.success(f"All entries for room '{selected_room}' deleted!")
+                            else:
+                                st.error(f"Error: {response.status_code} - {response.text}")
                     else:
-                        st.error(f"Error fetching entries: {response.status_code} - {response.text}")
+                        st.info("No entries found")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
             
             elif delete_option == "Multiple Entries":
                 # Fetch entries for selection
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
+                    entries = api_client.entries(st.session_state.client)
                     
-                    if response.status_code == 200:
-                        entries = response.json()
+                    if entries:
+                        # Create selection options
+                        entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e["id"] for e in entries}
+                        selected_entries = st.multiselect("Select Entries to Delete", list(entry_options.keys()))
+                        entry_ids = [entry_options[entry] for entry in selected_entries]
                         
-                        if entries:
-                            # Create selection options
-                            entry_options = {f"{e['id']} - {e['label']} ({e['room']})": e["id"] for e in entries}
-                            selected_entries = st.multiselect("Select Entries to Delete", list(entry_options.keys()))
-                            entry_ids = [entry_options[entry] for entry in selected_entries]
+                        if st.button("Delete Selected Entries"):
+                            response = api_client.delete_entries(st.session_state.client, ids=entry_ids)
                             
-                            if st.button("Delete Selected Entries"):
-                                response = requests.post(
-                                    f"{API_URL}/entry/delete",
-                                    params={"client": st.session_state.client},
-                                    json={"id": entry_ids}
-                                )
-                                
-                                if response.status_code == 200:
-                                    st.success(f"{len(entry_ids)} entries deleted successfully!")
-                                else:
-                                    st.error(f"Error: {response.status_code} - {response.text}")
-                        else:
-                            st.info("No entries found")
+                            if response.status_code == 200:
+                                st.success(f"{len(entry_ids)} entries deleted successfully!")
+                            else:
+                                st.error(f"Error: {response.status_code} - {response.text}")
                     else:
-                        st.error(f"Error fetching entries: {response.status_code} - {response.text}")
+                        st.info("No entries found")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
 
@@ -567,13 +567,9 @@ elif page == "Camera Management":
             with col1:
                 # Get rooms from schedule entries to populate filter
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
-                    if response.status_code == 200:
-                        entries = response.json()
-                        unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
-                        room_filter = st.selectbox("Filter by Room", ["All Rooms"] + list(unique_rooms))
-                    else:
-                        room_filter = st.text_input("Filter by Room")
+                    entries = api_client.entries(st.session_state.client)
+                    unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
+                    room_filter = st.selectbox("Filter by Room", ["All Rooms"] + list(unique_rooms))
                 except:
                     room_filter = st.text_input("Filter by Room")
             
@@ -582,37 +578,19 @@ elif page == "Camera Management":
                                                help="Enter 0 to show all sectors")
             
             # Fetch camera data based on filters
-            # try:
-            if room_filter and room_filter != "All Rooms":
-                if sector_filter > 0:
-                    # Get specific room and sector
-                    response = requests.get(
-                        f"{API_URL}/cam",
-                        params={
-                            "client": st.session_state.client,
-                            "room": room_filter,
-                            "sector": sector_filter
-                        }
-                    )
+            try:
+                if room_filter and room_filter != "All Rooms":
+                    # Get all cameras in a room, or a specific room and sector
+                    cameras = api_client.cameras(st.session_state.client, room_filter,
+                                                 sector_filter if sector_filter > 0 else None)
                 else:
-                    # Get all cameras in a room
-                    response = requests.get(
-                        f"{API_URL}/cam",
-                        params={
-                            "client": st.session_state.client,
-                            "room": room_filter
-                        }
-                    )
-            else:
-                # Get all cameras for client
-                response = requests.get(
-                    f"{API_URL}/cam",
-                    params={"client": st.session_state.client}
-                )
+                    # Get all cameras for client
+                    cameras = api_client.cameras(st.session_state.client)
+            except api_client.APIError as e:
+                cameras = None
+                st.error(f"Error fetching cameras: {e}")
             
-            if response.status_code == 200:
-                cameras = response.json()
-                
+            if cameras is not None:
                 # Convert to list if single camera returned
                 if isinstance(cameras, dict):
                     cameras = [cameras]
@@ -622,48 +600,41 @@ elif page == "Camera Management":
                     df = pd.DataFrame(cameras)
                     st.dataframe(df, use_container_width=True)
                     
-                    def camcapture(rtsp_url: str) -> Image.Image:
-                        """
-                        Capture a single frame from an RTSP stream and return it as a PIL Image.
-
-                        Args:
-                            rtsp_url (str): The RTSP URL of the IP camera.
-
-                        Returns:
-                            PIL.Image.Image: A PIL Image of the current frame.
-                        """
-                        cap = cv2.VideoCapture(rtsp_url)
-                        if not cap.isOpened():
-                            raise ValueError(f"Unable to open RTSP stream: {rtsp_url}")
-
-                        ret, frame = cap.read()
-                        cap.release()
-
-                        if not ret:
-                            raise RuntimeError("Failed to read frame from stream.")
-
-                        # Convert from BGR (OpenCV) to RGB (PIL)
-                        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        return Image.fromarray(frame_rgb)
-
-                    # Display camera previews
+                    # Display camera previews a page at a time; the grid reruns on its own
+                    # only while thumbnails are still arriving
                     st.subheader("Camera Previews")
-                    preview_columns = st.columns(3)
+                    pages = -(-len(cameras) // PREVIEW_PAGE_SIZE)
+                    preview_page = st.number_input("Preview Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+                    shown = cameras[(preview_page - 1) * PREVIEW_PAGE_SIZE:preview_page * PREVIEW_PAGE_SIZE]
+                    links = [camera["link"] for camera in shown]
+                    previews = preview_service()
+                    previews.request(links)
+                    waiting = previews.pending(links)
                     
-                    for i, camera in enumerate(cameras):
-                        col_idx = i % 3
+                    @st.fragment(run_every=PREVIEW_REFRESH if waiting else None)
+                    def preview_grid(cameras):
+                        preview_columns = st.columns(3)
+                        
+                        for i, camera in enumerate(cameras):
+                            with preview_columns[i % 3]:
+                                caption = f"Room: {camera['room']}, Sector: {camera['sector']}"
+                                preview = previews.get(camera["link"])
+                                if preview and preview["jpeg"]:
+                                    st.image(preview["jpeg"], caption=caption)
+                                else:
+                                    st.caption(caption)
+                                if preview is None:
+                                    st.info("Connecting...")
+                                elif preview["error"]:
+                                    st.warning(f"Camera unavailable: {preview['error']}")
                         
-                        with preview_columns[col_idx]:
-                            if st.button(f" Room: {camera['room']}, Sector: {camera['sector']}"):
-                                with st.expander(f"Room: {camera['room']}, Sector: {camera['sector']}",True):
-                                    # st.write(type(camcapture(camera["link"])))
-                                    st.image(camcapture(camera["link"]))
+                        if waiting and not previews.pending(links):
+                            # Everything has arrived; rerun once to drop the refresh timer
+                            st.rerun()
+                    
+                    preview_grid(shown)
                 else:
                     st.info("No cameras found matching the criteria")
-            else:
-                st.error(f"Error fetching cameras: {response.status_code} - {response.text}")
-            # except Exception as e:
-            #     st.error(f"Error: {str(e.with_traceback())}")
         
         with tabs[1]:
             st.subheader("Add Camera")
@@ -671,21 +642,21 @@ elif page == "Camera Management":
             with st.form("add_camera_form"):
                 # Get existing rooms from API to populate dropdown
                 try:
-                    response = requests.get(f"{API_URL}/entry", params={"client": st.session_state.client})
-                    if response.status_code == 200:
-                        entries = response.json()
-                        unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
-                        room = st.selectbox("Room", [""] + list(unique_rooms) + ["New Room..."], accept_new_options =True)
-                        
-                        if room == "New Room...":
-                            room = st.text_input("Enter New Room Name")
-                    else:
-                        room = st.text_input("Room")
+                    entries = api_client.entries(st.session_state.client)
+                    unique_rooms = sorted(set(entry.get("room", "") for entry in entries if "room" in entry))
+                    room = st.selectbox("Room", [""] + list(unique_rooms) + ["New Room..."], accept_new_options =True)
+                    
+                    if room == "New Room...":
+                        room = st.text_input("Enter New Room Name")
                 except:
                     room = st.text_input("Room")
                 
                 sector = st.number_input("Sector", min_value=1, value=1)
                 link = st.text_input("Camera Link")
+                substream = st.text_input("Substream Link (optional)", help="Lower-resolution stream used for captures")
+                resolution = st.text_input("Capture Resolution (optional)", placeholder="1280x720")
+                roi = st.text_input("Table Region (optional)", placeholder="[[0.1, 0.3], [0.9, 0.3], [0.9, 1], [0.1, 1]]",
+                                    help=ROI_HELP)
                 
                 # Preview link if it's an image
                 if link and link.lower().endswith(('.png', '.jpg', '.jpeg')):
@@ -693,19 +664,25 @@ elif page == "Camera Management":
                 
                 submitted = st.form_submit_button("Add Camera")
                 
-                if submitted:
+                if submitted and resolution and not re.match(camera_import.RESOLUTION_PATTERN, resolution):
+                    st.error("Capture resolution must look like 1280x720")
+                elif submitted:
                     try:
+                        roi = sector_roi.parse_roi(roi)
                         # Prepare payload
                         payload = {
                             "id": "",  # API will generate UUID
                             "client": st.session_state.client,
                             "room": room,
                             "sector": sector,
-                            "link": link
+                            "link": link,
+                            "substream": substream,
+                            "resolution": resolution,
+                            "roi": roi
                         }
                         
                         # Make API request
-                        response = requests.post(f"{API_URL}/cam", json=payload)
+                        response = api_client.add_camera(payload)
                         
                         if response.status_code == 200:
                             st.success("Camera added successfully!")
@@ -726,8 +703,8 @@ elif page == "Camera Management":
                 if st.button("Find Camera"):
                     try:
                         # Make API request
-                        response = requests.get(
-                            f"{API_URL}/cam",
+                        response = api_client.get(
+                            "/cam",
                             params={
                                 "client": st.session_state.client,
                                 "room": room,
@@ -746,26 +723,34 @@ elif page == "Camera Management":
                                 new_room = st.text_input("New Room", value=camera["room"])
                                 new_sector = st.number_input("New Sector", min_value=1, value=camera["sector"])
                                 new_link = st.text_input("New Camera Link", value=camera["link"])
+                                new_substream = st.text_input("New Substream Link", value=camera.get("substream", ""))
+                                new_resolution = st.text_input("New Capture Resolution", value=camera.get("resolution", ""))
+                                new_roi = st.text_input("New Table Region", value=json.dumps(camera["roi"]) if camera.get("roi") else "",
+                                                        help=ROI_HELP)
                                 
                                 update_submitted = st.form_submit_button("Update Camera")
                                 
                                 if update_submitted:
                                     # Prepare payload
+                                    try:
+                                        new_roi = sector_roi.parse_roi(new_roi)
+                                    except (TypeError, ValueError) as e:
+                                        st.error(f"Invalid table region: {str(e)}")
+                                        st.stop()
+                                    if new_resolution and not re.match(camera_import.RESOLUTION_PATTERN, new_resolution):
+                                        st.error("Capture resolution must look like 1280x720")
+                                        st.stop()
                                     payload = {
                                         "room": new_room,
                                         "sector": new_sector,
-                                        "link": new_link
+                                        "link": new_link,
+                                        "substream": new_substream,
+                                        "resolution": new_resolution,
+                                        "roi": new_roi
                                     }
                                     
                                     # Make update request
-                                    update_response = requests.post(
-                                        f"{API_URL}/cam/update",
-                                        params={
-                                            "client": st.session_state.client,
-                                            "id": camera["id"]
-                                        },
-                                        json=payload
-                                    )
+                                    update_response = api_client.update_camera(st.session_state.client, camera["id"], payload)
                                     
                                     if update_response.status_code == 200:
                                         st.success("Camera updated successfully!")
@@ -782,8 +767,8 @@ elif page == "Camera Management":
                 if st.button("Find Camera"):
                     try:
                         # Make API request
-                        response = requests.get(
-                            f"{API_URL}/cam",
+                        response = api_client.get(
+                            "/cam",
                             params={
                                 "client": st.session_state.client,
                                 "id": camera_id
@@ -798,26 +783,34 @@ elif page == "Camera Management":
                                 new_room = st.text_input("New Room", value=camera["room"])
                                 new_sector = st.number_input("New Sector", min_value=1, value=camera["sector"])
                                 new_link = st.text_input("New Camera Link", value=camera["link"])
+                                new_substream = st.text_input("New Substream Link", value=camera.get("substream", ""))
+                                new_resolution = st.text_input("New Capture Resolution", value=camera.get("resolution", ""))
+                                new_roi = st.text_input("New Table Region", value=json.dumps(camera["roi"]) if camera.get("roi") else "",
+                                                        help=ROI_HELP)
                                 
                                 update_submitted = st.form_submit_button("Update Camera")
                                 
                                 if update_submitted:
                                     # Prepare payload
+                                    try:
+                                        new_roi = sector_roi.parse_roi(new_roi)
+                                    except (TypeError, ValueError) as e:
+                                        st.error(f"Invalid table region: {str(e)}")
+                                        st.stop()
+                                    if new_resolution and not re.match(camera_import.RESOLUTION_PATTERN, new_resolution):
+                                        st.error("Capture resolution must look like 1280x720")
+                                        st.stop()
                                     payload = {
                                         "room": new_room,
                                         "sector": new_sector,
-                                        "link": new_link
+                                        "link": new_link,
+                                        "substream": new_substream,
+                                        "resolution": new_resolution,
+                                        "roi": new_roi
                                     }
                                     
                                     # Make update request
-                                    update_response = requests.post(
-                                        f"{API_URL}/cam/update",
-                                        params={
-                                            "client": st.session_state.client,
-                                            "id": camera_id
-                                        },
-                                        json=payload
-                                    )
+                                    update_response = api_client.update_camera(st.session_state.client, camera_id, payload)
                                     
                                     if update_response.status_code == 200:
                                         st.success("Camera updated successfully!")
@@ -840,14 +833,7 @@ elif page == "Camera Management":
                 if st.button("Delete Camera"):
                     try:
                         # Make API request
-                        response = requests.post(
-                            f"{API_URL}/cam/delete",
-                            params={
-                                "client": st.session_state.client,
-                                "room": room,
-                                "sector": sector
-                            }
-                        )
+                        response = api_client.delete_camera(st.session_state.client, room=room, sector=sector)
                         
                         if response.status_code == 200:
                             st.success(f"Camera in room '{room}', sector {sector} deleted successfully!")
@@ -862,13 +848,7 @@ elif page == "Camera Management":
                 if st.button("Delete Camera"):
                     try:
                         # Make API request
-                        response = requests.post(
-                            f"{API_URL}/cam/delete",
-                            params={
-                                "client": st.session_state.client,
-                                "id": camera_id
-                            }
-                        )
+                        response = api_client.delete_camera(st.session_state.client, id=camera_id)
                         
                         if response.status_code == 200:
                             st.success(f"Camera with ID '{camera_id}' deleted successfully!")
@@ -883,13 +863,7 @@ elif page == "Camera Management":
                 if st.button("Delete All Cameras in Room"):
                     try:
                         # Make API request
-                        response = requests.post(
-                            f"{API_URL}/cam/delete",
-                            params={
-                                "client": st.session_state.client,
-                                "room": room
-                            }
-                        )
+                        response = api_client.delete_camera(st.session_state.client, room=room)
                         
                         if response.status_code == 200:
                             st.success(f"All cameras in room '{room}' deleted successfully!")
@@ -901,7 +875,7 @@ elif page == "Camera Management":
         with tabs[4]:
             st.subheader("Bulk Import Cameras")
             
-            st.write("Upload a CSV file with camera data. Required columns: room, sector, link")
+            st.write("Upload a CSV file with camera data. Required columns: room, sector, link. Optional: substream, resolution, roi")
             
             uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
             
@@ -910,54 +884,59 @@ elif page == "Camera Management":
                     # Read the CSV file
                     df = pd.read_csv(uploaded_file)
                     
-                    # Validate required columns
-                    required_columns = ["room", "sector", "link"]
-                    if not all(col in df.columns for col in required_columns):
-                        st.error(f"CSV file must contain these columns: {', '.join(required_columns)}")
-                    else:
-                        # Display preview
-                        st.write("Preview of uploaded data:")
-                        st.dataframe(df.head())
+                    # Skip cameras that are already registered
+                    try:
+                        existing = api_client.cameras(st.session_state.client)
+                    except api_client.APIError:
+                        existing = []
+                    if isinstance(existing, dict):
+                        existing = [existing]
+                    existing = [(cam.get("room", ""), cam.get("sector", 1)) for cam in existing]
+                    
+                    records, invalid = camera_import.validate_cameras(df, existing=existing)
+                    
+                    # Display preview
+                    st.write("Preview of uploaded data:")
+                    st.dataframe(df.head())
+                    st.info(f"{len(records)} of {len(df)} rows are ready to import")
+                    if invalid:
+                        with st.expander(f"{len(invalid)} rows will be skipped"):
+                            st.dataframe(pd.DataFrame(invalid), hide_index=True)
+                    
+                    if records and st.button("Import Cameras"):
+                        progress_bar = st.progress(0)
+                        imported = []
+                        failure = None
                         
-                        if st.button("Import Cameras"):
-                            progress_bar = st.progress(0)
-                            success_count = 0
-                            error_count = 0
-                            error_messages = []
-                            
-                            for i, row in df.iterrows():
+                        # One request per camera over the shared keep-alive session; the
+                        # API has no batch insert, so the first failure undoes the rest
+                        for i, cam in enumerate(records):
+                            try:
+                                response = api_client.add_camera(dict(cam, client=st.session_state.client))
+                                if response.status_code != 200:
+                                    failure = f"Room {cam['room']} sector {cam['sector']}: {response.text}"
+                            except Exception as e:
+                                failure = f"Room {cam['room']} sector {cam['sector']}: {str(e)}"
+                            if failure:
+                                break
+                            imported.append(cam)
+                            progress_bar.progress((i + 1) / len(records))
+                        
+                        if failure is None:
+                            st.success(f"Successfully imported {len(imported)} cameras")
+                        else:
+                            leftover = []
+                            for cam in imported:
                                 try:
-                                    # Prepare payload
-                                    payload = {
-                                        "id": "",  # API will generate UUID
-                                        "client": st.session_state.client,
-                                        "room": str(row["room"]),
-                                        "sector": int(row["sector"]),
-                                        "link": str(row["link"])
-                                    }
-                                    
-                                    # Make API request
-                                    response = requests.post(f"{API_URL}/cam", json=payload)
-                                    
-                                    if response.status_code == 200:
-                                        success_count += 1
-                                    else:
-                                        error_count += 1
-                                        error_messages.append(f"Row {i+1}: {response.text}")
-                                except Exception as e:
-                                    error_count += 1
-                                    error_messages.append(f"Row {i+1}: {str(e)}")
-                                
-                                # Update progress
-                                progress_bar.progress((i + 1) / len(df))
-                            
-                            # Show results
-                            st.success(f"Successfully imported {success_count} cameras")
-                            if error_count > 0:
-                                st.error(f"Failed to import {error_count} cameras")
-                                with st.expander("Error Details"):
-                                    for msg in error_messages:
-                                        st.write(msg)
+                                    response = api_client.delete_camera(st.session_state.client, cam["room"], cam["sector"])
+                                    if response.status_code != 200:
+                                        leftover.append(cam)
+                                except Exception:
+                                    leftover.append(cam)
+                            st.error(f"Import stopped at {failure}. Nothing was imported.")
+                            if leftover:
+                                st.warning("These cameras could not be removed again: " +
+                                           ", ".join(f"{cam['room']} sector {cam['sector']}" for cam in leftover))
                 except Exception as e:
                     st.error(f"Error processing file: {str(e)}")
 
@@ -980,81 +959,84 @@ elif page == "Reports":
         with col2:
             end_date = st.date_input("End Date", datetime.now())
         
-        # Button to generate report
+        granularity = st.radio("Group By", ["daily", "hourly"], horizontal=True, format_func=str.title)
+        
+        # Button to generate report; the query is kept so the report survives reruns
         if st.button("Generate Report"):
             if not room:
                 st.error("Please enter a room name")
             else:
-                try:
-                    # Convert date to datetime with time set to beginning/end of day
-                    start_datetime = datetime.combine(start_date, datetime.min.time())
-                    end_datetime = datetime.combine(end_date, datetime.max.time())
+                # Convert date to datetime with time set to beginning/end of day
+                st.session_state.report_query = {
+                    "client": st.session_state.client,
+                    "room": room,
+                    "start": datetime.combine(start_date, datetime.min.time()).isoformat(),
+                    "end": datetime.combine(end_date, datetime.max.time()).isoformat(),
+                }
+        
+        query = st.session_state.get("report_query")
+        if query and query["client"] == st.session_state.client:
+            try:
+                start, end = datetime.fromisoformat(query["start"]), datetime.fromisoformat(query["end"])
+                summary = report_summary(query["client"], query["room"], start, end, granularity)
+                
+                if summary["captures"]:
+                    total_detections = summary["detections"]
+                    st.success(f"Report generated successfully! Found {total_detections} detections.")
                     
-                    # Make API request
-                    response = requests.post(
-                        f"{API_URL}/report",
-                        params={
-                            "room": room,
-                            "client": st.session_state.client
-                        },
-                        json={
-                            "start": start_datetime.isoformat(),
-                            "end": end_datetime.isoformat()
-                        }
-                    )
+                    # Display metrics
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Total Detections", total_detections)
+                    with col2:
+                        st.metric("Date Range", f"{query['start'][:10]} - {query['end'][:10]}")
+                    with col3:
+                        st.metric("Number of Captures", summary["captures"])
                     
-                    if response.status_code == 200:
-                        report_data = response.json()
-                        
-                        if report_data:
-                            # Convert to DataFrame for better display
-                            df = pd.DataFrame(report_data)
-                            
-                            # Basic stats
-                            total_detections = sum(item.get("detections", 0) for item in report_data)
-                            
-                            st.success(f"Report generated successfully! Found {total_detections} detections.")
-                            
-                            # Display metrics
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("Total Detections", total_detections)
-                            with col2:
-                                st.metric("Date Range", f"{start_date.strftime('%b %d')} - {end_date.strftime('%b %d')}")
-                            with col3:
-                                st.metric("Number of Records", len(report_data))
-                            
-                            # Display detailed data
-                            st.subheader("Detection Records")
-                            st.dataframe(df, use_container_width=True)
-                            
-                            # Option to download as CSV
-                            csv = df.to_csv(index=False)
-                            st.download_button(
-                                label="Download CSV",
-                                data=csv,
-                                file_name=f"tabsense_report_{room}_{start_date}_{end_date}.csv",
-                                mime="text/csv"
-                            )
-                            
-                            # Visualization section
-                            st.subheader("Visualization")
-                            
-                            # Convert timestamp to date for grouping
-                            if 'timestamp' in df.columns:
-                                df['date'] = pd.to_datetime(df['timestamp']).dt.date
-                                
-                                # Group by date and count detections
-                                detections_by_date = df.groupby('date')['detections'].sum().reset_index()
-                                
-                                # Plot
-                                st.line_chart(detections_by_date.set_index('date'))
-                        else:
-                            st.info("No detection data found for the selected criteria")
-                    else:
-                        st.error(f"Error: {response.status_code} - {response.text}")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+                    # Totals per day or hour and per sector come straight from the rollups
+                    periods = pd.DataFrame(summary["periods"], columns=["period", "detections", "captures"])
+                    sectors = pd.DataFrame(summary["sectors"], columns=["sector", "detections", "captures"])
+                    
+                    # Visualization section
+                    st.subheader("Visualization")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.line_chart(periods.set_index("period")["detections"])
+                    with col2:
+                        st.bar_chart(sectors.astype({"sector": str}).set_index("sector")["detections"])
+                    
+                    # Full exports are only built on request, from a cursor into a temporary file
+                    name = f"tabsense_report_{query['room']}_{query['start'][:10]}_{query['end'][:10]}"
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        fmt = st.selectbox("Export Format", list(report_export.FORMATS), format_func=str.upper)
+                    with col2:
+                        if st.button("Prepare Export"):
+                            with tempfile.TemporaryFile(buffering=0) as export_file, st.spinner("Exporting records..."):
+                                rows = report_export.report_cursor(database(), query["client"], query["room"], start, end)
+                                mime, extension = report_export.export(rows, export_file, fmt)
+                                export_file.seek(0)
+                                st.download_button(label=f"Download {fmt.upper()}", data=export_file,
+                                                   file_name=f"{name}.{extension}", mime=mime)
+                    with col3:
+                        st.download_button(
+                            label="Download Summary CSV",
+                            data=periods.to_csv(index=False),
+                            file_name=f"{name}_{granularity}.csv",
+                            mime="text/csv"
+                        )
+                    
+                    # Raw records are fetched a page at a time
+                    st.subheader("Detection Records")
+                    page_number = st.number_input("Page", min_value=1, value=1)
+                    records = report_records(query["client"], query["room"], start, end, int(page_number))
+                    pages = max(1, -(-records["total"] // records["page_size"]))
+                    st.caption(f"Page {page_number} of {pages} ({records['total']} records, newest first)")
+                    st.dataframe(pd.DataFrame(records["records"]), use_container_width=True)
+                else:
+                    st.info("No detection data found for the selected criteria")
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
         
         # Example of custom report
         with st.expander("Custom Reports"):
@@ -0,0 +1,177 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Longest single sleep, so wall-clock changes are picked up eventually
+MAX_SLEEP = 300
+
+
+def _parse_time(value):
+    return value if isinstance(value, datetime.time) else datetime.time.fromisoformat(value)
+
+
+def daily_at(at, days):
+    """Next-fire function for a fixed time of day on the given weekday names"""
+    at = _parse_time(at)
+
+    def next_fire(now):
+        for offset in range(8):
+            candidate = datetime.datetime.combine(now.date() + datetime.timedelta(days=offset), at)
+            if candidate > now and candidate.strftime("%A") in days:
+                return candidate
+        return None
+
+    return next_fire
+
+
+def every_in_window(start, end, days, interval):
+    """Next-fire function for every `interval` from `start` through `end` on the given days.
+
+    A window whose end is not after its start runs past midnight.
+    """
+    start, end = _parse_time(start), _parse_time(end)
+
+    def next_fire(now):
+        for offset in range(-1, 8):
+            window_start = datetime.datetime.combine(now.date() + datetime.timedelta(days=offset), start)
+            window_end = datetime.datetime.combine(window_start.date(), end)
+            if window_end <= window_start:
+                window_end += datetime.timedelta(days=1)
+            if window_start.strftime("%A") not in days or window_end <= now:
+                continue
+            if window_start > now:
+                return window_start
+            candidate = window_start + ((now - window_start) // interval + 1) * interval
+            if candidate <= window_end:
+                return candidate
+        return None
+
+    return next_fire
+
+
+def window_opened(start, end, days):
+    """Function mapping a time to the start of the `start`-`end` window it falls in, or None.
+
+    Windows run on the given days; one whose end is not after its start runs past midnight.
+    """
+    start, end = _parse_time(start), _parse_time(end)
+
+    def opened(now):
+        for offset in (0, -1):
+            window_start = datetime.datetime.combine(now.date() + datetime.timedelta(days=offset), start)
+            window_end = datetime.datetime.combine(window_start.date(), end)
+            if window_end <= window_start:
+                window_end += datetime.timedelta(days=1)
+            if window_start.strftime("%A") in days and window_start <= now <= window_end:
+                return window_start
+        return None
+
+    return opened
+
+
+def in_window(start, end, days):
+    """Predicate telling whether a time falls inside the `start`-`end` window on the given days"""
+    opened = window_opened(start, end, days)
+
+    def contains(now):
+        return opened(now) is not None
+
+    return contains
+
+
+def every(interval):
+    """Next-fire function for a fixed interval"""
+    def next_fire(now):
+        return now + interval
+
+    return next_fire
+
+
+class EventScheduler:
+    """Heap-based scheduler that sleeps until the next due event.
+
+    Each job has a next-fire function that maps the current time to the
+    following run (or None to stop). Jobs can be added and removed from any
+    thread; the run loop is woken whenever the earliest event changes.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._heap = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def add(self, key, next_fire, func):
+        """Schedule `func` under `key`, replacing any job already using that key"""
+        with self._cond:
+            when = next_fire(datetime.datetime.now())
+            job = {"key": key, "next_fire": next_fire, "func": func, "when": when}
+            self._jobs[key] = job
+            if when is not None:
+                heapq.heappush(self._heap, (when, next(self._counter), job))
+                self._cond.notify()
+        return key
+
+    def remove(self, key):
+        """Drop a job; its pending heap slot is discarded lazily"""
+        with self._cond:
+            return self._jobs.pop(key, None) is not None
+
+    def keys(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def next_fire_times(self):
+        """Map each job key to its next scheduled run"""
+        with self._cond:
+            return {key: job["when"] for key, job in self._jobs.items()}
+
+    def _pop_due(self):
+        """Wait for the earliest live job to become due and take it off the heap"""
+        with self._cond:
+            while not self._stopped:
+                # Skip heap slots of removed or rescheduled jobs
+                while self._heap and self._jobs.get(self._heap[0][2]["key"]) is not self._heap[0][2]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait(MAX_SLEEP)
+                    continue
+
+                when, _, job = self._heap[0]
+                delay = (when - datetime.datetime.now()).total_seconds()
+                if delay > 0:
+                    self._cond.wait(min(delay, MAX_SLEEP))
+                    continue
+
+                heapq.heappop(self._heap)
+                job["when"] = job["next_fire"](max(datetime.datetime.now(), when))
+                if job["when"] is not None:
+                    heapq.heappush(self._heap, (job["when"], next(self._counter), job))
+                return job
+            return None
+
+    def run_forever(self):
+        """Run jobs as they come due until `stop` is called"""
+        while True:
+            job = self._pop_due()
+            if job is None:
+                return
+            try:
+                if self.executor is not None:
+                    self.executor.submit(job["func"])
+                else:
+                    job["func"]()
+            except Exception as e:
+                logger.error(f"Error running scheduled job {job['key']}: {str(e)}")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
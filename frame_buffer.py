@@ -0,0 +1,107 @@
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Upper bound on frames held in memory between capture and detection
+MAX_FRAMES = 512
+
+
+class FrameBuffer:
+    """Shared in-memory hand-off of captured frames, keyed by (capture id, sector).
+
+    Capture workers put frames in and the detection stage takes them out,
+    so frames never need to round-trip through PNG files. The oldest frames
+    are dropped once `max_frames` is reached.
+    """
+
+    def __init__(self, max_frames=MAX_FRAMES):
+        self.max_frames = max_frames
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, capture_id, sector, frame):
+        with self._lock:
+            self._frames[(capture_id, sector)] = frame
+            self._frames.move_to_end((capture_id, sector))
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+    def get(self, capture_id, sector):
+        with self._lock:
+            return self._frames.get((capture_id, sector))
+
+    def pop(self, capture_id, sector):
+        with self._lock:
+            return self._frames.pop((capture_id, sector), None)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._frames
+
+
+class FrameArchiver:
+    """Background writer that persists frames to disk after detection.
+
+    Writes are queued and handled by a single daemon thread, so archival
+    never sits on the capture or detection path. With an ImageStore frames
+    are written through it and stored once per distinct content; with a
+    Thumbnailer the preview derivative is made from the same frame.
+    """
+
+    def __init__(self, max_pending=256, thumbnails=None, store=None):
+        self.thumbnails = thumbnails
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="frame-archiver", daemon=True)
+        self._thread.start()
+
+    def save(self, path, frame, capture_id=None, sector=None, like=None):
+        """Queue a frame to be written to `path`; drops it if the archive is backed up.
+
+        With a store, `like` names an archived path the frame is taken to
+        match, whose blob is linked instead of writing a new one.
+        """
+        try:
+            self._queue.put_nowait((path, frame, capture_id, sector, like))
+        except queue.Full:
+            logger.warning(f"Archive queue full, dropping {path}")
+
+    def _write(self, path, frame, capture_id, sector, like=None):
+        if self.store is not None:
+            if like and self.store.alias(path, like, capture_id=capture_id, sector=sector):
+                return
+            self.store.put(path, frame, capture_id=capture_id, sector=sector)
+            if self.thumbnails is not None:
+                # Derivatives are keyed by the file's bytes, as the dashboard looks them up
+                with open(path, "rb") as f:
+                    self.thumbnails.add(path, f.read(), frame)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ok, data = cv2.imencode(os.path.splitext(path)[1], frame)
+        if not ok:
+            raise RuntimeError("encoding failed")
+        with open(path, "wb") as f:
+            f.write(data.tobytes())
+        if self.thumbnails is not None:
+            self.thumbnails.add(path, data.tobytes(), frame)
+
+    def _run(self):
+        while True:
+            path, frame, capture_id, sector, like = self._queue.get()
+            try:
+                self._write(path, frame, capture_id, sector, like)
+            except Exception as e:
+                logger.error(f"Failed to archive frame to {path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued frame has been written"""
+        self._queue.join()
@@ -0,0 +1,219 @@
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+import cv2
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Root of the image tree; blobs and the index live beneath it
+IMAGE_ROOT = "imagedata"
+# Days images are kept before retention removes them; 0 keeps them forever
+RETAIN_DAYS = int(os.getenv("TABSENSE_RETAIN_DAYS", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    capture_id TEXT,
+    sector INTEGER,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_hash ON images(hash);
+CREATE INDEX IF NOT EXISTS images_capture ON images(capture_id, sector);
+CREATE INDEX IF NOT EXISTS images_created ON images(created);
+"""
+
+
+def frame_hash(frame):
+    """Hash of a frame's pixels, so identical frames match without encoding them.
+
+    Live frames of a static scene still differ in sensor noise, so these
+    only match exact copies; near-copies are linked with `ImageStore.alias`.
+    """
+    digest = hashlib.sha256(f"{frame.shape}{frame.dtype}".encode())
+    digest.update(memoryview(frame if frame.flags.c_contiguous else frame.copy()))
+    return digest.hexdigest()[:32]
+
+
+def bytes_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class ImageStore:
+    """Content-addressed storage for captured frames.
+
+    Each distinct frame is written once to blobs/<hash[:2]>/<hash>.<ext>;
+    the familiar imagedata/control/... and imagedata/captures/... paths are
+    hard links to the blob, so readers of those paths are unaffected. A
+    SQLite index maps every logical path and capture id to its blob, and
+    drives retention and compaction of unreferenced blobs. With a
+    Thumbnailer, a blob's preview derivatives go when the blob does.
+    """
+
+    def __init__(self, root=IMAGE_ROOT, retain_days=RETAIN_DAYS, thumbnails=None):
+        self.root = root
+        self.retain_days = retain_days
+        self.thumbnails = thumbnails
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Keeps compaction from deleting a blob that a put is about to link
+        self._gate = threading.RLock()
+
+    def blob_path(self, digest, ext):
+        return os.path.join(self.root, "blobs", digest[:2], f"{digest}{ext}")
+
+    def _write_blob(self, digest, ext, frame, data):
+        """Write a blob unless it is already stored; returns its path"""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+
+        if data is None:
+            ok, encoded = cv2.imencode(ext, frame)
+            if not ok:
+                raise RuntimeError(f"Failed to encode frame as {ext}")
+            data = encoded.tobytes()
+        path = self.blob_path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (hash, path, size, created) VALUES (?, ?, ?, ?)",
+                (digest, path, len(data), datetime.datetime.now().isoformat()),
+            )
+        return path
+
+    @staticmethod
+    def _link(blob, path):
+        """Point a logical path at a blob, replacing whatever was there"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            # Filesystems without hard links get a copy
+            with open(blob, "rb") as src, open(tmp, "wb") as dst:
+                dst.write(src.read())
+        os.replace(tmp, path)
+
+    def _index(self, path, digest, capture_id, sector):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (path, hash, capture_id, sector, created) VALUES (?, ?, ?, ?, ?)",
+                (path, digest, capture_id, sector, datetime.datetime.now().isoformat()),
+            )
+
+    def put(self, path, frame=None, data=None, capture_id=None, sector=None):
+        """Store a frame (or already encoded bytes) at a logical path; returns the blob hash"""
+        ext = os.path.splitext(path)[1] or ".png"
+        digest = bytes_hash(data) if data is not None else frame_hash(frame)
+        with self._gate:
+            blob = self._write_blob(digest, ext, frame, data)
+            self._link(blob, path)
+            self._index(path, digest, capture_id, sector)
+        return digest
+
+    def alias(self, path, source, capture_id=None, sector=None):
+        """Store a logical path as the blob already stored at `source`.
+
+        Used for a capture the change gate found unchanged, so it costs no
+        new blob. Returns the blob hash, or None if `source` is not stored.
+        """
+        with self._gate:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT b.hash, b.path FROM images i JOIN blobs b ON b.hash = i.hash WHERE i.path = ?", (source,)
+                ).fetchone()
+            if row is None or not os.path.exists(row[1]):
+                return None
+            self._link(row[1], path)
+            self._index(path, row[0], capture_id, sector)
+        return row[0]
+
+    def lookup(self, capture_id, sector=None):
+        """Logical paths and blob hashes stored for a capture id"""
+        query = "SELECT path, hash FROM images WHERE capture_id = ?"
+        params = [capture_id]
+        if sector is not None:
+            query += " AND sector = ?"
+            params.append(sector)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def apply_retention(self, retain_days=None):
+        """Forget images older than the retention period and remove their paths"""
+        retain_days = self.retain_days if retain_days is None else retain_days
+        if retain_days <= 0:
+            return 0
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retain_days)).isoformat()
+        with self._lock:
+            expired = [row[0] for row in self._db.execute("SELECT path FROM images WHERE created < ?", (cutoff,))]
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in expired])
+        return len(expired)
+
+    def compact(self):
+        """Delete blobs that no image refers to any more; returns (blobs removed, bytes freed)"""
+        with self._gate:
+            with self._lock:
+                orphans = self._db.execute(
+                    "SELECT hash, path, size FROM blobs b WHERE NOT EXISTS (SELECT 1 FROM images i WHERE i.hash = b.hash)"
+                ).fetchall()
+            for _, path, _ in orphans:
+                try:
+                    if self.thumbnails is not None:
+                        # Derivatives are named after the file's bytes, which are the blob's
+                        with open(path, "rb") as f:
+                            self.thumbnails.discard(f.read())
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with self._lock, self._db:
+                self._db.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest, _, _ in orphans])
+        with self._lock:
+            self._db.execute("VACUUM")
+        return len(orphans), sum(size for _, _, size in orphans)
+
+    def maintain(self):
+        """Apply retention, then compact; run periodically by the scheduler"""
+        expired = self.apply_retention()
+        removed, freed = self.compact()
+        thumbs = 0
+        if self.thumbnails is not None and self.retain_days > 0:
+            # Derivatives of images kept elsewhere are remade the next time they are shown
+            thumbs = self.thumbnails.prune(self.retain_days * 86400)
+        if expired or removed or thumbs:
+            logger.info(f"Image retention removed {expired} images, {removed} blobs ({freed / 1e6:.1f} MB) "
+                        f"and {thumbs} thumbnails")
+
+    def stats(self):
+        """Logical image count, stored blob count and bytes on disk"""
+        with self._lock:
+            images = self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            blobs, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"images": images, "blobs": blobs, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
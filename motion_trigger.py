@@ -0,0 +1,113 @@
+import datetime
+import logging
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger("TabSense-Cameras")
+
+# Size frames are reduced to before background subtraction
+MOTION_SIZE = (160, 90)
+# Seconds between looks at each watched camera
+SAMPLE_INTERVAL = 0.5
+# Share of foreground pixels that counts as activity in a sector
+MOTION_THRESHOLD = 0.01
+# Samples the background model learns from before motion is reported
+WARMUP_SAMPLES = 20
+# Frames of history the background model keeps
+MOTION_HISTORY = 240
+
+
+def _small(frame):
+    small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+
+class MotionTrigger:
+    """Fires captures when activity in a sector has stopped.
+
+    Samples the pooled stream of every watched sector a couple of times a
+    second, runs MOG2 background subtraction on a tiny greyscale copy and
+    tracks when each sector last moved. Once a sector that saw activity
+    has been still for `settle` seconds, `on_settle(sectors)` is called
+    with it and any other sectors of the same watch that settled together.
+    """
+
+    def __init__(self, pool, settle, interval=SAMPLE_INTERVAL, threshold=MOTION_THRESHOLD):
+        self.pool = pool
+        self.settle = settle
+        self.interval = interval
+        self.threshold = threshold
+        # key -> {"sources", "on_settle", "active", "sectors"}
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="motion-trigger", daemon=True)
+        self._thread.start()
+
+    def watch(self, key, sources, on_settle, active=None):
+        """Watch sectors given as {sector: (link, resolution)}, replacing any watch under `key`.
+
+        `active(now)` limits when motion is tracked, e.g. to a schedule window.
+        """
+        sectors = {
+            sector: {"subtractor": None, "samples": 0, "moving": False, "last_motion": 0.0}
+            for sector in sources
+        }
+        with self._lock:
+            self._watches[key] = {"sources": dict(sources), "on_settle": on_settle,
+                                  "active": active, "sectors": sectors}
+        logger.info(f"Watching {key} for motion in sectors {sorted(sources)}")
+
+    def unwatch(self, key):
+        with self._lock:
+            return self._watches.pop(key, None) is not None
+
+    def _sample(self, state, link, resolution, now):
+        """Update one sector from its latest frame; returns True when it has just settled"""
+        frame = self.pool.sample(link, max_age=self.interval * 4, resolution=resolution)
+        if frame is None:
+            return False
+        if state["subtractor"] is None:
+            state["subtractor"] = cv2.createBackgroundSubtractorMOG2(history=MOTION_HISTORY, detectShadows=False)
+        mask = state["subtractor"].apply(_small(frame))
+        state["samples"] += 1
+        if state["samples"] <= WARMUP_SAMPLES:
+            return False
+
+        if cv2.countNonZero(mask) / mask.size >= self.threshold:
+            state["moving"], state["last_motion"] = True, now
+            return False
+        if state["moving"] and now - state["last_motion"] >= self.settle:
+            state["moving"] = False
+            return True
+        return False
+
+    def _tick(self):
+        now = time.monotonic()
+        with self._lock:
+            watches = list(self._watches.items())
+        for key, watch in watches:
+            if watch["active"] is not None and not watch["active"](datetime.datetime.now()):
+                continue
+            settled = []
+            for sector, (link, resolution) in watch["sources"].items():
+                try:
+                    if self._sample(watch["sectors"][sector], link, resolution, now):
+                        settled.append(sector)
+                except Exception as e:
+                    logger.warning(f"Motion check of {key}, sector {sector} failed: {str(e)}")
+            if settled:
+                logger.info(f"Activity in {key} settled for sectors {settled}")
+                try:
+                    watch["on_settle"](settled)
+                except Exception as e:
+                    logger.error(f"Motion-triggered capture of {key} failed: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._tick()
+
+    def close(self):
+        self._stop.set()
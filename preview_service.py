@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+logger = logging.getLogger("TabSense-Cameras")
+
+# Seconds a thumbnail is served before it is fetched again
+PREVIEW_TTL = 10
+# Seconds to wait for a camera before its preview is marked failed
+PREVIEW_TIMEOUT = 5
+# Thumbnail width in pixels and JPEG quality
+PREVIEW_WIDTH = 320
+PREVIEW_QUALITY = 70
+
+
+def encode_thumbnail(frame, width=PREVIEW_WIDTH, quality=PREVIEW_QUALITY):
+    """Downscale a BGR frame to `width` and encode it as JPEG bytes"""
+    height, frame_width = frame.shape[:2]
+    if frame_width > width:
+        frame = cv2.resize(frame, (width, max(1, round(height * width / frame_width))), interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Failed to encode thumbnail")
+    return data.tobytes()
+
+
+class PreviewService:
+    """Fetches camera thumbnails in the background for the dashboard.
+
+    `request` starts a fetch for every link whose thumbnail is missing or
+    older than `ttl` and returns at once; `get` hands back whatever is
+    cached, so the page never waits on a camera. Frames come from the
+    shared CameraPool, and each fetch gives up after `timeout` seconds.
+    """
+
+    def __init__(self, pool, max_workers=8, timeout=PREVIEW_TIMEOUT, ttl=PREVIEW_TTL):
+        self.pool = pool
+        self.timeout = timeout
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        # link -> {"jpeg", "error", "fetched"}
+        self._previews = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, link):
+        try:
+            frame = self.pool.read(link, timeout=self.timeout)
+            if frame is None:
+                raise RuntimeError(f"No frame within {self.timeout}s")
+            preview = {"jpeg": encode_thumbnail(frame), "error": None}
+        except Exception as e:
+            logger.warning(f"Preview of {link} failed: {str(e)}")
+            with self._lock:
+                # Keep showing the last good thumbnail alongside the error
+                preview = {"jpeg": self._previews.get(link, {}).get("jpeg"), "error": str(e)}
+        preview["fetched"] = time.monotonic()
+        with self._lock:
+            self._previews[link] = preview
+            self._pending.discard(link)
+
+    def request(self, links):
+        """Start fetching every link whose thumbnail is missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            due = [link for link in dict.fromkeys(map(str, links))
+                   if link not in self._pending
+                   and now - self._previews.get(link, {}).get("fetched", -self.ttl) >= self.ttl]
+            self._pending.update(due)
+        for link in due:
+            self._executor.submit(self._fetch, link)
+        return len(due)
+
+    def get(self, link):
+        """The cached preview for a link, or None before the first fetch completes"""
+        with self._lock:
+            return self._previews.get(str(link))
+
+    def pending(self, links=None):
+        """Whether any of `links` (or any link at all) is still being fetched"""
+        with self._lock:
+            if links is None:
+                return bool(self._pending)
+            return any(str(link) in self._pending for link in links)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
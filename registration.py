@@ -0,0 +1,117 @@
+import functools
+import logging
+
+import cv2
+import numpy as np
+
+import stain_kernel
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Pyramid level phase correlation runs on; each level halves the frame
+PHASE_LEVEL = 1
+# Lowest phase-correlation peak trusted as a clean shift
+MIN_RESPONSE = 0.2
+# Grey-level difference left after a shift in 90% of the frame, beyond
+# which the drift is not a plain translation (rotation, zoom) and
+# keypoints are matched; stains cover too little of a table to reach it
+MAX_RESIDUAL = 8
+# Largest drift in working-resolution pixels taken for camera movement
+# rather than a changed scene
+MAX_SHIFT = 48
+# Fewest matched keypoints a fallback transform must agree with
+MIN_INLIERS = 25
+# Corrections smaller than this, in pixels, are not worth resampling for
+MIN_CORRECTION = 0.5
+
+_IDENTITY = np.eye(2, 3, dtype=np.float64)
+
+
+def _level(gray, level=PHASE_LEVEL):
+    for _ in range(level):
+        gray = cv2.pyrDown(gray)
+    return gray
+
+
+def _scaled(transform, factor):
+    """The same transform expressed in coordinates scaled by `factor`"""
+    scaled = transform.copy()
+    scaled[:, 2] *= factor
+    return scaled
+
+
+def _compose(outer, inner):
+    """Affine transform applying `inner` first, then `outer`"""
+    return (np.vstack([outer, [0, 0, 1]]) @ np.vstack([inner, [0, 0, 1]]))[:2]
+
+
+@functools.lru_cache(maxsize=8)
+def _window(shape):
+    return cv2.createHanningWindow(shape[::-1], cv2.CV_32F)
+
+
+def phase_shift(control_level, current_level):
+    """Translation of `current_level` relative to `control_level`, as ((dx, dy), response)"""
+    return cv2.phaseCorrelate(np.float32(control_level), np.float32(current_level), _window(control_level.shape))
+
+
+def keypoint_transform(control, gray):
+    """Similarity transform mapping `gray` onto the control by ORB matching, or None"""
+    control_points, control_descriptors = control.keypoints()
+    points, descriptors = cv2.ORB_create(len(control_points) or 1).detectAndCompute(gray, None)
+    if control_descriptors is None or descriptors is None:
+        return None
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors, control_descriptors)
+    if len(matches) < MIN_INLIERS:
+        return None
+    src = np.float32([points[m.queryIdx].pt for m in matches])
+    dst = np.float32([control_points[m.trainIdx].pt for m in matches])
+    transform, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None or int(inliers.sum()) < MIN_INLIERS:
+        return None
+    return transform
+
+
+def estimate(control, gray, previous=None):
+    """Transform mapping a current greyscale frame onto its control.
+
+    Starts from `previous`, the transform that aligned the camera's last
+    capture, and measures what drift remains with phase correlation on a
+    downsampled level. The shift is only kept if it leaves the level
+    matching the control; otherwise, e.g. after a rotation or zoom,
+    keypoints are matched instead.
+    """
+    previous = _IDENTITY if previous is None else previous
+    factor = 2 ** PHASE_LEVEL
+    reference = control.pyramid[PHASE_LEVEL] if len(control.pyramid) > PHASE_LEVEL else _level(control.plane)
+    level = _level(cv2.GaussianBlur(gray, stain_kernel.BLUR_SIZE, 0))
+    size = level.shape[::-1]
+    if previous is not _IDENTITY:
+        level = cv2.warpAffine(level, _scaled(previous, 1 / factor), size, borderMode=cv2.BORDER_REPLICATE)
+    (dx, dy), response = phase_shift(reference, level)
+    if response >= MIN_RESPONSE and np.hypot(dx, dy) * factor <= MAX_SHIFT:
+        shift = np.array([[1, 0, -dx], [0, 1, -dy]])
+        residual = cv2.absdiff(reference, cv2.warpAffine(level, shift, size, borderMode=cv2.BORDER_REPLICATE))
+        if np.percentile(residual, 90) <= MAX_RESIDUAL:
+            return _compose(_scaled(shift, factor), previous)
+
+    transform = keypoint_transform(control, gray)
+    if transform is None:
+        logger.warning("Could not register capture to its control; keeping the last alignment")
+        return previous
+    return transform
+
+
+def align(control, frame, previous=None):
+    """Warp a current frame onto its control's viewpoint; returns (aligned frame, transform).
+
+    Pass the returned transform as `previous` for the camera's next capture.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    transform = estimate(control, gray, previous)
+    height, width = frame.shape[:2]
+    corners = np.float64([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]])
+    if np.abs(corners @ (transform - _IDENTITY).T).max() < MIN_CORRECTION:
+        return frame, transform
+    aligned = cv2.warpAffine(frame, transform, frame.shape[1::-1], flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return aligned, transform
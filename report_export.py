@@ -0,0 +1,126 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Raw detection rows held in memory at once while exporting
+CHUNK_SIZE = 5000
+
+# Columns of an exported report, in order
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("control", pa.string()),
+    ("current", pa.string()),
+    ("detections", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("sectors", pa.string()),
+    ("unchanged", pa.string()),
+    ("quality", pa.string()),
+])
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def report_cursor(db, client, room, start, end, chunk_size=CHUNK_SIZE):
+    """Server-side cursor over a room's raw detections, oldest first"""
+    return (
+        db[f"{client}-{room}"]
+        .find({"timestamp": {"$gte": start, "$lte": end}}, {"_id": 0})
+        .sort("timestamp", 1)
+        .batch_size(chunk_size)
+    )
+
+
+def _frame(chunk):
+    frame = pd.DataFrame(chunk, columns=SCHEMA.names)
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"])
+    return frame
+
+
+def _frames(rows, chunk_size):
+    """Group rows into DataFrames of at most `chunk_size` with the export columns"""
+    chunk = []
+    for row in rows:
+        chunk.append({
+            "id": row.get("id"),
+            "control": row.get("control"),
+            "current": row.get("current"),
+            "detections": row.get("detections", 0),
+            "timestamp": row.get("timestamp"),
+            # Boxes per sector and the per-sector fields are nested, so they travel as JSON strings
+            "sectors": json.dumps(row.get("sectors", {})),
+            "unchanged": json.dumps(row.get("unchanged", [])),
+            "quality": json.dumps(row.get("quality", {})),
+        })
+        if len(chunk) == chunk_size:
+            yield _frame(chunk)
+            chunk = []
+    if chunk:
+        yield _frame(chunk)
+
+
+def csv_chunks(rows, chunk_size=CHUNK_SIZE):
+    """Yield a CSV export as encoded chunks, the header with the first"""
+    header = True
+    for frame in _frames(rows, chunk_size):
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+    if header:
+        yield (",".join(SCHEMA.names) + "\n").encode()
+
+
+class _Drain:
+    """Write-only file that hands back whatever was written since the last take"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def parquet_chunks(rows, chunk_size=CHUNK_SIZE):
+    """Yield a Parquet export one row group at a time"""
+    sink = _Drain()
+    with pq.ParquetWriter(sink, SCHEMA, compression="zstd") as writer:
+        for frame in _frames(rows, chunk_size):
+            writer.write_table(pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False))
+            yield sink.take()
+    yield sink.take()
+
+
+def export(rows, sink, fmt="csv", chunk_size=CHUNK_SIZE):
+    """Encode detection records as a CSV or Parquet file written to `sink`.
+
+    Rows are converted and written `chunk_size` at a time, so memory use is
+    bounded by the chunk whatever the size of the report. Returns (media
+    type, file extension).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    media_type, extension = FORMATS[fmt]
+    for chunk in csv_chunks(rows, chunk_size) if fmt == "csv" else parquet_chunks(rows, chunk_size):
+        sink.write(chunk)
+    return media_type, extension
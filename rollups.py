@@ -0,0 +1,129 @@
+import datetime
+import logging
+
+from pymongo import ASCENDING, UpdateOne
+
+import client_summary
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Rollup granularities, kept in one collection each
+GRANULARITIES = ("daily", "hourly")
+# Raw detection rows returned per page
+PAGE_SIZE = 100
+
+
+def rollup_collection(client, granularity):
+    return f"{client}-rollup-{granularity}"
+
+
+def bucket(timestamp, granularity):
+    """Start of the daily or hourly bucket a timestamp falls in"""
+    if granularity == "daily":
+        return datetime.datetime.combine(timestamp.date(), datetime.time())
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def ensure_indexes(db, client):
+    for granularity in GRANULARITIES:
+        db[rollup_collection(client, granularity)].create_index(
+            [("room", ASCENDING), ("period", ASCENDING), ("sector", ASCENDING)], unique=True
+        )
+
+
+def capture_counts(doc):
+    """Detections per sector of a stored capture, with 0 for the sectors that came out clean"""
+    counts = {str(sector): 0 for sector in [*(doc.get("quality") or {}), *(doc.get("unchanged") or [])]}
+    counts.update({str(sector): len(boxes) for sector, boxes in (doc.get("sectors") or {}).items()})
+    return counts
+
+
+def _increments(room, sector_counts, timestamp, granularity):
+    period = bucket(timestamp, granularity)
+    return [
+        UpdateOne(
+            {"room": room, "sector": int(sector), "period": period},
+            {"$inc": {"detections": count, "captures": 1}},
+            upsert=True,
+        )
+        for sector, count in sector_counts.items()
+    ]
+
+
+def _record_rollups(db, client, room, sector_counts, timestamp):
+    for granularity in GRANULARITIES:
+        db[rollup_collection(client, granularity)].bulk_write(
+            _increments(room, sector_counts, timestamp, granularity), ordered=False
+        )
+
+
+def record(db, client, room, sector_counts, timestamp):
+    """Add one capture's detections per sector to the rollups and the client's daily count.
+
+    Every captured sector counts as a capture, so clean sectors are passed
+    with a count of 0.
+    """
+    if not sector_counts:
+        return
+    _record_rollups(db, client, room, sector_counts, timestamp)
+    client_summary.add_detections(db, client, sum(sector_counts.values()), timestamp)
+
+
+def rebuild(db, client, room):
+    """Recompute a room's rollups from its raw detection records"""
+    for granularity in GRANULARITIES:
+        db[rollup_collection(client, granularity)].delete_many({"room": room})
+    ensure_indexes(db, client)
+
+    count = 0
+    for doc in db[f"{client}-{room}"].find({"timestamp": {"$type": "date"}},
+                                           {"sectors": 1, "quality": 1, "unchanged": 1, "timestamp": 1}):
+        sector_counts = capture_counts(doc)
+        if sector_counts:
+            _record_rollups(db, client, room, sector_counts, doc["timestamp"])
+        count += 1
+    logger.info(f"Rebuilt rollups for client {client}, room {room} from {count} records")
+    return count
+
+
+def summary(db, client, room, start, end, granularity="daily"):
+    """Detection totals for a room between two datetimes, read from the rollups.
+
+    Returns the overall totals plus the totals per period and per sector.
+    """
+    match = {"$match": {"room": room, "period": {"$gte": bucket(start, granularity), "$lte": end}}}
+    totals = {"detections": {"$sum": "$detections"}, "captures": {"$sum": "$captures"}}
+    collection = db[rollup_collection(client, granularity)]
+
+    # Every sector counts each capture, so a room's captures are its busiest sector's
+    by_period = list(collection.aggregate([
+        match,
+        {"$group": {"_id": "$period", "detections": {"$sum": "$detections"}, "captures": {"$max": "$captures"}}},
+        {"$sort": {"_id": 1}},
+    ]))
+    by_sector = list(collection.aggregate([
+        match,
+        {"$group": {"_id": "$sector", **totals}},
+        {"$sort": {"_id": 1}},
+    ]))
+    return {
+        "detections": sum(row["detections"] for row in by_sector),
+        "captures": sum(row["captures"] for row in by_period),
+        "periods": [{"period": row["_id"], "detections": row["detections"], "captures": row["captures"]}
+                    for row in by_period],
+        "sectors": [{"sector": row["_id"], "detections": row["detections"], "captures": row["captures"]}
+                    for row in by_sector],
+    }
+
+
+def records(db, client, room, start, end, page=1, page_size=PAGE_SIZE):
+    """One page of raw detection records, newest first, with the total count"""
+    query = {"timestamp": {"$gte": start, "$lte": end}}
+    collection = db[f"{client}-{room}"]
+    rows = list(
+        collection.find(query, {"_id": 0})
+        .sort("timestamp", -1)
+        .skip((max(page, 1) - 1) * page_size)
+        .limit(page_size)
+    )
+    return {"total": collection.count_documents(query), "page": page, "page_size": page_size, "records": rows}
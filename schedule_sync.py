@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import threading
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Seconds between polls when change streams are not available
+POLL_INTERVAL = 30
+SCHEDULE_SUFFIX = "-schedule"
+
+
+def _digest(entry):
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ScheduleSync:
+    """Keeps scheduler jobs in step with the {client}-schedule collections.
+
+    Only entries that were added, changed or deleted are passed on:
+    `on_upsert(client, entry)` returns the job key for an entry and
+    `on_remove(key)` drops it. Changes are read from a MongoDB change
+    stream when the server is a replica set, and otherwise found by
+    polling and diffing each entry against the version last applied.
+    """
+
+    def __init__(self, db, on_upsert, on_remove, mode="auto", poll_interval=POLL_INTERVAL):
+        self.db = db
+        self.on_upsert = on_upsert
+        self.on_remove = on_remove
+        self.mode = mode
+        self.poll_interval = poll_interval
+        # (client, _id) -> (job key, digest)
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _apply(self, client, entry):
+        ident = (client, str(entry["_id"]))
+        digest = _digest(entry)
+        with self._lock:
+            applied = self._applied.get(ident)
+            if applied and applied[1] == digest:
+                return False
+        try:
+            key = self.on_upsert(client, entry)
+        except Exception as e:
+            logger.error(f"Error scheduling entry {ident[1]} for client {client}: {str(e)}")
+            return False
+        with self._lock:
+            if applied and applied[0] != key:
+                self.on_remove(applied[0])
+            self._applied[ident] = (key, digest)
+        return True
+
+    def _drop(self, client, doc_id=None):
+        with self._lock:
+            gone = [ident for ident in self._applied
+                    if ident[0] == client and (doc_id is None or ident[1] == str(doc_id))]
+            for ident in gone:
+                self.on_remove(self._applied.pop(ident)[0])
+        return len(gone)
+
+    def clients(self):
+        """Client names that have a schedule collection"""
+        names = self.db.list_collection_names(filter={"name": {"$regex": f"{SCHEDULE_SUFFIX}$"}})
+        return [name[:-len(SCHEDULE_SUFFIX)] for name in names]
+
+    def poll(self):
+        """Diff every schedule collection against what is applied; returns the number of changes"""
+        changes = 0
+        clients = self.clients()
+        for client in clients:
+            seen = set()
+            for entry in self.db[f"{client}{SCHEDULE_SUFFIX}"].find({}):
+                seen.add(str(entry["_id"]))
+                changes += self._apply(client, entry)
+            with self._lock:
+                stale = [ident[1] for ident in self._applied if ident[0] == client and ident[1] not in seen]
+            for doc_id in stale:
+                changes += self._drop(client, doc_id)
+        # Clients whose collection disappeared entirely
+        with self._lock:
+            orphaned = {ident[0] for ident in self._applied} - set(clients)
+        for client in orphaned:
+            changes += self._drop(client)
+        return changes
+
+    def _handle_change(self, change):
+        coll = change.get("ns", {}).get("coll", "")
+        if not coll.endswith(SCHEDULE_SUFFIX):
+            return
+        client = coll[:-len(SCHEDULE_SUFFIX)]
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            if change.get("fullDocument") is not None:
+                self._apply(client, change["fullDocument"])
+            else:
+                # The entry was deleted again before the lookup ran
+                self._drop(client, change["documentKey"]["_id"])
+        elif operation == "delete":
+            self._drop(client, change["documentKey"]["_id"])
+        elif operation == "drop":
+            self._drop(client)
+
+    def watch(self):
+        """Apply changes from a change stream until stopped; raises if streams are unsupported"""
+        pipeline = [{"$match": {"ns.coll": {"$regex": f"{SCHEDULE_SUFFIX}$"}}}]
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with self.db.watch(pipeline, full_document="updateLookup", resume_after=resume_token,
+                                   max_await_time_ms=1000) as stream:
+                    if resume_token is None:
+                        # Stream is open, so nothing after this full load is missed
+                        self.poll()
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self._handle_change(change)
+                        resume_token = stream.resume_token
+            except OperationFailure:
+                raise
+            except PyMongoError as e:
+                logger.error(f"Schedule change stream interrupted: {str(e)}")
+                self._stop.wait(5)
+
+    def run(self):
+        """Keep schedules in sync until `stop` is called"""
+        if self.mode in ("auto", "watch"):
+            try:
+                logger.info("Watching schedule collections for changes")
+                self.watch()
+                return
+            except OperationFailure as e:
+                if self.mode == "watch":
+                    raise
+                logger.info(f"Change streams unavailable ({e.code}), polling schedules every {self.poll_interval}s")
+
+        while not self._stop.is_set():
+            try:
+                changes = self.poll()
+                if changes:
+                    logger.info(f"Applied {changes} schedule changes")
+            except PyMongoError as e:
+                logger.error(f"Error polling schedules: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="schedule-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
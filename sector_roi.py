@@ -0,0 +1,57 @@
+import functools
+import json
+
+import cv2
+import numpy as np
+
+from stain_kernel import WORK_SIZE
+
+# Fewest corners a table polygon can have
+MIN_POINTS = 3
+# Distinct polygons whose crop and mask are kept
+CACHE_SIZE = 1024
+
+
+def parse_roi(value):
+    """Validate a table polygon given as a JSON string or a list of [x, y] points.
+
+    Points are fractions of the frame width and height, so a region stays
+    valid whatever resolution the camera delivers. Returns the points as a
+    list of [x, y] floats, or None when `value` is empty.
+    """
+    if value in (None, "", []):
+        return None
+    points = json.loads(value) if isinstance(value, str) else value
+    if len(points) < MIN_POINTS:
+        raise ValueError(f"A table region needs at least {MIN_POINTS} points")
+    parsed = []
+    for point in points:
+        x, y = (float(v) for v in point)
+        if not (0 <= x <= 1 and 0 <= y <= 1):
+            raise ValueError("Table region points must be fractions of the frame between 0 and 1")
+        parsed.append([x, y])
+    return parsed
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _region(points, size):
+    width, height = size
+    polygon = np.round(np.array(points) * [width - 1, height - 1]).astype(np.int32)
+    x, y, w, h = cv2.boundingRect(polygon)
+    mask = np.zeros((h, w), np.uint8)
+    cv2.fillPoly(mask, [(polygon - [x, y]).astype(np.int32)], 255)
+    mask.setflags(write=False)
+    return x, y, w, h, mask
+
+
+def region(roi, size=WORK_SIZE):
+    """Crop rectangle and mask of a table polygon as (x, y, w, h, mask).
+
+    Computed once per polygon and size. The mask covers the rectangle and
+    is 255 on the table. Returns None when the sector has no region,
+    meaning the whole frame.
+    """
+    if not roi:
+        return None
+    return _region(tuple((float(x), float(y)) for x, y in roi), tuple(size))
+
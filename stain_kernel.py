@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+
+# Working resolution for the comparison
+WORK_SIZE = (1024, 576)
+# Grey-level difference that counts as a change
+DIFF_THRESHOLD = 30
+# Smallest stain area, in working-resolution pixels
+MIN_AREA = 150
+# OpenCV handles at most 512 channels per image, so larger batches are split
+MAX_BATCH = 512
+
+# Blur applied to both frames before they are compared
+BLUR_SIZE = (5, 5)
+
+_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+# Context kept around a crop so blurring it matches blurring the whole frame
+_MARGIN = BLUR_SIZE[0] // 2
+
+COLORS = {
+    "blue": (255, 0, 0),
+    "red": (0, 0, 255),
+    "green": (0, 255, 0),
+    "yellow": (0, 255, 255),
+}
+
+
+def _fit(frame):
+    if frame.shape[1::-1] == WORK_SIZE:
+        return frame
+    return cv2.resize(frame, WORK_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def prepare(frame):
+    """Blurred greyscale plane of a whole frame, as the comparison sees it.
+
+    A control compared against many frames can be prepared once and passed
+    to `detect_batch` in place of the frame.
+    """
+    return cv2.GaussianBlur(cv2.cvtColor(_fit(frame), cv2.COLOR_BGR2GRAY), BLUR_SIZE, 0)
+
+
+def _crop(image, region, margin=0):
+    """Crop to a region grown by `margin`, mirroring the image edge where the margin runs off it"""
+    if region is None:
+        return image
+    x, y, w, h, _ = region
+    height, width = image.shape[:2]
+    top, left = y - margin, x - margin
+    bottom, right = y + h + margin, x + w + margin
+    crop = image[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+    if top < 0 or left < 0 or bottom > height or right > width:
+        # The same mirroring GaussianBlur applies at the edge of the whole frame
+        crop = cv2.copyMakeBorder(crop, max(-top, 0), max(bottom - height, 0), max(-left, 0), max(right - width, 0),
+                                  cv2.BORDER_REFLECT_101)
+    return crop
+
+
+def _planes(frames, regions):
+    """Blurred greyscale planes of the frames' regions, laid out as (H, W, N).
+
+    Frames are BGR images, or planes from `prepare` that only need cropping.
+    """
+    planes = [_crop(frame, region) if frame.ndim == 2 else None for frame, region in zip(frames, regions)]
+    raw = [i for i, plane in enumerate(planes) if plane is None]
+    if raw:
+        margin = 0 if regions[raw[0]] is None else _MARGIN
+        stack = np.stack([_crop(_fit(frames[i]), regions[i], margin) for i in raw])
+        n, h, w, _ = stack.shape
+        gray = cv2.cvtColor(stack.reshape(n * h, w, 3), cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+        # OpenCV filters every channel of a multi-channel image in one call, so
+        # putting the batch on the channel axis blurs all sectors at once
+        blurred = cv2.GaussianBlur(np.ascontiguousarray(gray.transpose(1, 2, 0)), BLUR_SIZE, 0)
+        blurred = blurred.reshape(h, w, n)[margin:h - margin, margin:w - margin]
+        if len(raw) == len(frames):
+            return blurred
+        for plane, i in enumerate(raw):
+            planes[i] = blurred[:, :, plane]
+    return np.dstack(planes)
+
+
+def diff_masks(controls: np.ndarray, currents: np.ndarray):
+    """Threshold and clean the control/current difference for a stack of sectors.
+
+    Takes two (H, W, N) stacks of blurred greyscale planes and returns an
+    (H, W, N) uint8 mask with one plane per sector.
+    """
+    diff = cv2.absdiff(controls, currents)
+    _, mask = cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, _KERNEL)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, _KERNEL)
+    return mask.reshape(mask.shape[0], mask.shape[1], -1)
+
+
+def _boxes(mask):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= MIN_AREA]
+
+
+def detect_batch(controls, currents, regions=None):
+    """Compare the control and current frames of many sectors at once.
+
+    `controls` and `currents` are equal-length sequences of BGR frames;
+    a control may also be the plane `prepare` made of it. `regions`
+    optionally gives each sector's table area as the (x, y, w, h, mask)
+    of `sector_roi.region`, or None for the whole frame; only pixels
+    inside it are compared. Returns one list of
+    (x, y, w, h) boxes per sector, in working-resolution coordinates.
+    """
+    regions = regions or [None] * len(controls)
+    # Sectors cropped to the same size still share one batch
+    groups = {}
+    for i, region in enumerate(regions):
+        groups.setdefault(None if region is None else region[2:4], []).append(i)
+
+    results = [None] * len(controls)
+    for indices in groups.values():
+        for start in range(0, len(indices), MAX_BATCH):
+            batch = indices[start:start + MAX_BATCH]
+            batch_regions = [regions[i] for i in batch]
+            masks = diff_masks(_planes([controls[i] for i in batch], batch_regions),
+                               _planes([currents[i] for i in batch], batch_regions))
+            for plane, i in enumerate(batch):
+                mask = np.ascontiguousarray(masks[:, :, plane])
+                if regions[i] is None:
+                    results[i] = _boxes(mask)
+                    continue
+                x, y, _, _, table = regions[i]
+                results[i] = [(bx + x, by + y, bw, bh) for bx, by, bw, bh in _boxes(cv2.bitwise_and(mask, table))]
+    return results
+
+
+def detect_sector(control: np.ndarray, current: np.ndarray, region=None):
+    """Compare a control and current frame of one sector"""
+    return detect_batch([control], [current], [region])[0]
+
+
+def highlight(frame: np.ndarray, boxes, color="blue"):
+    """Draw detection boxes on a working-resolution copy of the frame"""
+    if frame.shape[1::-1] != WORK_SIZE:
+        frame = cv2.resize(frame, WORK_SIZE, interpolation=cv2.INTER_AREA)
+    else:
+        frame = frame.copy()
+    for x, y, w, h in boxes:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), COLORS.get(color, COLORS["blue"]), 2)
+    return frame
@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("TabSense-Scheduler")
+
+# Where reduced-resolution derivatives are kept
+THUMB_DIR = "imagedata/thumbs"
+# Width of the preview derivative; full-size images are only read on demand
+THUMB_WIDTH = 480
+THUMB_QUALITY = 80
+# WebP when this OpenCV build can write it, JPEG otherwise
+THUMB_FORMAT = "webp" if cv2.haveImageWriter("thumb.webp") else "jpg"
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:20]
+
+
+def _encode(frame, width, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    height, frame_width = frame.shape[:2]
+    if frame_width > width:
+        frame = cv2.resize(frame, (width, max(1, round(height * width / frame_width))), interpolation=cv2.INTER_AREA)
+    flag = cv2.IMWRITE_WEBP_QUALITY if fmt == "webp" else cv2.IMWRITE_JPEG_QUALITY
+    ok, data = cv2.imencode(f".{fmt}", frame, [flag, quality])
+    if not ok:
+        raise RuntimeError(f"Failed to encode {fmt} thumbnail")
+    return data.tobytes()
+
+
+class Thumbnailer:
+    """Content-addressed cache of reduced-resolution image derivatives.
+
+    A derivative is named after the hash of its source file's bytes, so it
+    is generated once, never goes stale, and can be served with long-lived
+    caching. Derivatives are made at write time through `add`, or lazily
+    the first time `thumbnail` is asked for an image.
+    """
+
+    def __init__(self, root=THUMB_DIR, width=THUMB_WIDTH):
+        self.root = root
+        self.width = width
+        # source path -> ((mtime, size), content hash)
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def derivative_path(self, digest, width=None):
+        return os.path.join(self.root, digest[:2], f"{digest}-{width or self.width}.{THUMB_FORMAT}")
+
+    def _write(self, digest, frame, width):
+        path = self.derivative_path(digest, width)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(_encode(frame, width))
+            os.replace(tmp, path)
+        return path
+
+    def _remember(self, source, digest):
+        stat = os.stat(source)
+        with self._lock:
+            self._hashes[source] = ((stat.st_mtime_ns, stat.st_size), digest)
+
+    def add(self, source, data, frame=None, width=None):
+        """Record freshly written source bytes and make their derivative; returns its path"""
+        digest = content_hash(data)
+        if frame is None:
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        path = self._write(digest, frame, width or self.width)
+        self._remember(source, digest)
+        return path
+
+    def digest(self, source):
+        """Content hash of a source image, reading it only when it changed since last asked"""
+        stat = os.stat(source)
+        with self._lock:
+            known = self._hashes.get(source)
+        if known and known[0] == (stat.st_mtime_ns, stat.st_size):
+            return known[1]
+        with open(source, "rb") as f:
+            data = f.read()
+        digest = content_hash(data)
+        with self._lock:
+            self._hashes[source] = ((stat.st_mtime_ns, stat.st_size), digest)
+        return digest
+
+    def thumbnail(self, source, width=None):
+        """Path of the derivative for a source image, generating it if needed"""
+        width = width or self.width
+        digest = self.digest(source)
+        path = self.derivative_path(digest, width)
+        if not os.path.exists(path):
+            frame = cv2.imread(source, cv2.IMREAD_COLOR)
+            if frame is None:
+                raise RuntimeError(f"Failed to read image {source}")
+            self._write(digest, frame, width)
+        return path
+
+    def discard(self, data):
+        """Remove every derivative made from the given source bytes; returns how many were removed"""
+        digest = content_hash(data)
+        folder = os.path.join(self.root, digest[:2])
+        removed = 0
+        for name in os.listdir(folder) if os.path.isdir(folder) else []:
+            if name.startswith(f"{digest}-"):
+                try:
+                    os.remove(os.path.join(folder, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def prune(self, max_age):
+        """Remove derivatives written more than `max_age` seconds ago; they are remade on demand"""
+        cutoff = time.time() - max_age
+        removed = 0
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed